@@ -1,11 +1,16 @@
 import argparse
 import json
 import os
-import torch
+import random
 
+import model_registry
+from card_store import build_card_store, card_store_path_for
+from embedding_index import EMBEDDINGS_FILE, build_card_embeddings, embeddings_meta_path
+from result_store import ResultStore, store_files
+from sharding import QUEUE_PATH, partial_output_paths
+from synonyms import SYNONYM_FILE, normalize_card_tags
 
 TAG_FILE = "resources/tags.json"
-SYNONYM_FILE = "resources/tag_synonyms.json"
 
 
 def ensure_tag_file():
@@ -42,18 +47,49 @@ def main():
     parser.add_argument("--list", action="store_true", help="Alle Tags anzeigen")
     parser.add_argument("--synonyms", action="store_true", help="Synonyme anzeigen")
     parser.add_argument("--reset-all", action="store_true", help="Löscht alle generierten Tag-Daten und erstellt alles neu")
-    parser.add_argument("--workers", type=int, default=None, help="Anzahl paralleler Threads für rebuild")
+    parser.add_argument("--workers", type=int, default=None, help="Vorverarbeitungs-Prozesse für rebuild (Standard: ein Viertel der Kerne, höchstens 4); die übrigen Kerne, mindestens die Hälfte, gehen an die Inferenz")
+    parser.add_argument("--batch-size", type=int, default=8, help="Anzahl Bilder pro Inferenz-Batch für rebuild")
+    parser.add_argument("--compact", action="store_true", help="Schreibt card_tags_merged.json und den Kartenspeicher aus dem Ergebnis-Store neu")
+    parser.add_argument("--rescore", action="store_true", help="Bewertet Tags aller Karten aus dem Inferenz-Cache neu (nach Änderungen an tags.json)")
+    parser.add_argument("--normalize", action="store_true", help="Normalisiert die Tags aller Karten anhand von tag_synonyms.json")
+    parser.add_argument("--embeddings", action="store_true", help="Schreibt die Bild-Embeddings für /similar und /search/text aus dem Inferenz-Cache neu")
+    parser.add_argument("--backend", choices=model_registry.BACKENDS, default=None, help="Inferenz-Backend für rebuild und rescore")
+    parser.add_argument("--check-backend", choices=model_registry.BACKENDS[1:], default=None, help="Vergleicht Tags/Captions eines Backends mit fp32")
+    parser.add_argument("--sample", type=int, default=20, help="Anzahl Bilder für --check-backend")
     parser.add_argument("--dry-run", action="store_true", help="Nur anzeigen, was passieren würde, aber nichts ausführen")
     args = parser.parse_args()
 
+    if args.backend:
+        model_registry.set_backend(args.backend)
+
+    if args.check_backend:
+        from auto_captioning import check_backend_accuracy
+        from tag_provider import get_tags
+        images = sorted(f for f in os.listdir("images") if f.endswith(".jpg"))
+        random.Random(0).shuffle(images)
+        paths = [os.path.join("images", f) for f in images[:args.sample]]
+        report = check_backend_accuracy(paths, get_tags(), backend=args.check_backend)
+        print(f"\n🎯 {args.check_backend} gegenüber fp32 ({report['images']} Bilder):")
+        for key, value in report.items():
+            print(f"- {key}: {value:.3f}" if isinstance(value, float) else f"- {key}: {value}")
+        return
+
     if args.reset_all:
         print("\n🔁 Starte vollständigen Reset ...")
-        files_to_delete = [
+        outputs = [
             "resources/card_captions.json",
             "resources/card_tags.json",
             "resources/card_auto_tags.json",
+            "resources/card_text_tags.json",
             "resources/card_tags_merged.json"
         ]
+        files_to_delete = []
+        for output in outputs:
+            for path in [output] + partial_output_paths(output):
+                files_to_delete += [path] + store_files(path)
+        files_to_delete += [QUEUE_PATH, QUEUE_PATH + "-wal", QUEUE_PATH + "-shm"]
+        files_to_delete.append(card_store_path_for("resources/card_tags_merged.json"))
+        files_to_delete += [EMBEDDINGS_FILE, embeddings_meta_path(EMBEDDINGS_FILE)]
 
         for file in files_to_delete:
             if os.path.exists(file):
@@ -63,18 +99,25 @@ def main():
                     os.remove(file)
                     print(f"🗑️  Gelöscht: {file}")
 
+        # the inference cache (resources/cache) is kept, so only images without cached outputs hit the models
+        print("ℹ️  Inferenz-Cache bleibt erhalten.")
+
         if args.dry_run:
             print("📝 (dry-run) Würde jetzt alle Karten neu verarbeiten...")
         else:
-            from main import tag_all_parallel, update_tags_from_text_and_captions, export_json_for_frontend
+            from auto_tagging import tag_all_parallel
+            from nlp_processing import update_tags_from_text_and_captions
+            from ui_exporter import export_json_for_frontend
             import gc
+            import torch
 
             try:
                 tag_all_parallel(
                     "images",
                     "resources/scryfall-default-cards.json",
                     "resources/card_tags_merged.json",
-                    max_workers=args.workers
+                    max_workers=args.workers,
+                    batch_size=args.batch_size
                 )
             finally:
                 gc.collect()
@@ -82,10 +125,35 @@ def main():
                     torch.cuda.empty_cache()
 
             update_tags_from_text_and_captions()
+            build_card_store("resources/card_tags_merged.json")
+            build_card_embeddings("resources/card_tags_merged.json", "images")
             export_json_for_frontend()
             print("✅ Neuaufbau abgeschlossen.")
         return
 
+    if args.compact:
+        with ResultStore("resources/card_tags_merged.json") as store:
+            path = store.compact()
+        print(f"📦 {path} aus dem Ergebnis-Store geschrieben.")
+        build_card_store(path)
+        return
+
+    if args.rescore:
+        from auto_tagging import rescore_tags
+        rescore_tags("images", "resources/card_tags_merged.json")
+        normalize_card_tags("resources/card_tags_merged.json")
+        build_card_store("resources/card_tags_merged.json")
+        return
+
+    if args.embeddings:
+        build_card_embeddings("resources/card_tags_merged.json", "images")
+        return
+
+    if args.normalize:
+        normalize_card_tags("resources/card_tags_merged.json")
+        build_card_store("resources/card_tags_merged.json")
+        return
+
     if args.synonyms:
         print("\n🔗 Aktuelle Synonyme:")
         synonyms = load_synonyms()
@@ -1,29 +1,439 @@
 # api.py
-from fastapi import FastAPI, Query
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from typing import List, Optional
+import gzip
+import hashlib
 import json
+import os
+import threading
+import time
 
-app = FastAPI()
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from card_store import CardStore, card_store_path_for, open_card_index
+from embedding_index import EMBEDDINGS_FILE, EmbeddingIndex, embeddings_meta_path
+from search_index import CardIndex
+from synonyms import SYNONYM_FILE, build_expansion_index, canonical_tags, load_alias_index
+
+CARD_FILE = "resources/card_tags_merged.json"
+CARD_STORE_FILE = card_store_path_for(CARD_FILE)
+# seconds between checks of the card files, 0 disables the watcher
+RELOAD_INTERVAL = float(os.environ.get("CARD_RELOAD_INTERVAL", "5"))
+# bytes of cached (compressed) /search responses per dataset generation
+SEARCH_CACHE_BYTES = int(os.environ.get("SEARCH_CACHE_BYTES", str(64 * 2 ** 20)))
+# smaller responses are sent uncompressed
+MIN_COMPRESS_SIZE = 1000
+# /search/text queries beyond CLIP's 77 tokens are truncated anyway
+MAX_TEXT_QUERY_LENGTH = 1000
+CARD_FIELDS = ("id", "name", "colors", "type_line", "oracle_text", "legalities", "image_url",
+               "tags", "auto_tags", "text_tags", "caption")
+
+
+# least recently used entries are dropped once the cached bodies exceed maxbytes
+class LRUCache:
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value[0]
+
+    def put(self, key, value, size):
+        if size > self.maxbytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.maxbytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        return {"size": len(self.entries), "bytes": self.bytes, "maxbytes": self.maxbytes, "hits": self.hits, "misses": self.misses}
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# immutable snapshot of the card DB; requests read one snapshot and never see a half-built one
+class Dataset:
+    def __init__(self, path, index, generation, signature, alias_index=None, synonym_signature=None,
+                 embeddings=None, embedding_signature=None):
+        self.path = path
+        self.index = index
+        self.generation = generation
+        self.signature = signature
+        # alias -> canonical tag and canonical tag -> all its forms, from tag_synonyms.json
+        self.alias_index = alias_index or {}
+        self.expansions = build_expansion_index(self.alias_index)
+        self.synonym_signature = synonym_signature
+        # CLIP image embeddings for /similar and /search/text, None until the build step wrote them
+        self.embeddings = embeddings
+        self.embedding_signature = embedding_signature
+        self.version = f"{signature[1]:x}-{signature[2]:x}"
+        self.loaded_at = time.time()
+        # belongs to this snapshot, so a reload starts with an empty cache
+        self.search_cache = LRUCache(SEARCH_CACHE_BYTES)
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _synonym_signature():
+    return _file_signature(SYNONYM_FILE) if os.path.exists(SYNONYM_FILE) else None
+
+
+def _embedding_signature():
+    meta_path = embeddings_meta_path(EMBEDDINGS_FILE)
+    if not (os.path.exists(EMBEDDINGS_FILE) and os.path.exists(meta_path)):
+        return None
+    return _file_signature(EMBEDDINGS_FILE), _file_signature(meta_path)
+
+
+# the memory-mapped card store is preferred unless the JSON is newer (store not rebuilt yet)
+def _source_path():
+    if os.path.exists(CARD_STORE_FILE) and (
+            not os.path.exists(CARD_FILE) or os.stat(CARD_STORE_FILE).st_mtime_ns >= os.stat(CARD_FILE).st_mtime_ns):
+        return CARD_STORE_FILE
+    return CARD_FILE
+
+
+def load_dataset(path=None, generation=1):
+    path = path or _source_path()
+    signature = _file_signature(path)
+    synonym_signature = _synonym_signature()
+    embedding_signature = _embedding_signature()
+    alias_index = load_alias_index(SYNONYM_FILE)
+    if path.endswith(".bin"):
+        index = open_card_index(CardStore(path))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            index = CardIndex.from_cards(json.load(f))
+    embeddings = None
+    if embedding_signature:
+        embeddings = EmbeddingIndex(EMBEDDINGS_FILE, index, path if path.endswith(".bin") else None)
+    return Dataset(path, index, generation, signature, alias_index, synonym_signature, embeddings, embedding_signature)
+
+
+DATASET = load_dataset()
+_reload_lock = threading.Lock()
+
+
+# builds the new dataset next to the old one and swaps the reference once it is complete
+def reload_dataset(force=False):
+    global DATASET
+    with _reload_lock:
+        current = DATASET
+        path = _source_path()
+        if (not force and path == current.path and _file_signature(path) == current.signature
+                and _synonym_signature() == current.synonym_signature
+                and _embedding_signature() == current.embedding_signature):
+            return False
+        dataset = load_dataset(path, current.generation + 1)
+        DATASET = dataset
+    print(f"🔄 Kartendaten neu geladen (Generation {dataset.generation}, {len(dataset.index)} Karten).")
+    return True
+
+
+def _watch_card_file(stop):
+    while not stop.wait(RELOAD_INTERVAL):
+        try:
+            reload_dataset()
+        except Exception as e:
+            print(f"⚠️  Neuladen fehlgeschlagen, behalte Generation {DATASET.generation}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    stop = threading.Event()
+    if RELOAD_INTERVAL > 0:
+        threading.Thread(target=_watch_card_file, args=(stop,), daemon=True).start()
+    yield
+    stop.set()
+
+
+app = FastAPI(lifespan=lifespan)
+if BrotliMiddleware is not None:
+    # also falls back to gzip for clients without brotli support
+    app.add_middleware(BrotliMiddleware, minimum_size=MIN_COMPRESS_SIZE)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=MIN_COMPRESS_SIZE)
+
+
+def _status(dataset):
+    return {
+        "generation": dataset.generation,
+        "version": dataset.version,
+        "source": os.path.basename(dataset.path),
+        "cards": len(dataset.index),
+        "synonym_groups": len(dataset.expansions),
+        "embeddings": len(dataset.embeddings) if dataset.embeddings is not None else 0,
+        "search_cache": dataset.search_cache.stats(),
+        "loaded_at": dataset.loaded_at
+    }
+
+
+@app.get("/status")
+def status():
+    return _status(DATASET)
+
+
+@app.post("/admin/reload")
+def admin_reload(force: bool = False):
+    reloaded = reload_dataset(force=force)
+    return dict(_status(DATASET), reloaded=reloaded)
+
+
+def _parse_fields(fields):
+    if not fields:
+        return None
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in requested if field not in CARD_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unbekannte Felder: {', '.join(unknown)}")
+    return requested
+
+
+def _project(card_id, card, fields):
+    if fields is None:
+        return dict(card, id=card_id)
+    return {field: card_id if field == "id" else card.get(field) for field in fields}
+
+
+# equal filters in any order or spelling share one cache entry
+def _query_key(dataset, tags, colors, type_contains, legal_in, expand_aliases):
+    tags = list(tags or [])
+    if expand_aliases and dataset.alias_index:
+        tags = canonical_tags(tags, dataset.alias_index)
+    return (
+        tuple(sorted(set(tags))),
+        tuple(sorted(set(colors or []))),
+        type_contains.lower() if type_contains else None,
+        legal_in.lower() if legal_in else None,
+        bool(expand_aliases and dataset.alias_index)
+    )
+
+
+def _filter_bits(dataset, key):
+    tags, colors, type_contains, legal_in, expand = key
+    tag_alternatives = None
+    if expand:
+        # aliases resolve to their canonical tag, which also matches cards not normalized yet
+        tag_alternatives = {tag: dataset.expansions[tag] for tag in tags if tag in dataset.expansions}
+    return dataset.index.query(tags=tags, colors=colors, type_contains=type_contains, legal_in=legal_in,
+                               tag_alternatives=tag_alternatives)
+
+
+def _with_etag(dataset, data):
+    body = dumps(data)
+    return body, f'"{dataset.version}-{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+# br if the client accepts it and brotli is installed, else gzip, else None (uncompressed)
+def _response_encoding(request):
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        try:
+            # "gzip;q=0" rules gzip out
+            q = float(params.strip().removeprefix("q=") or 1)
+        except ValueError:
+            q = 1
+        if q > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, 6, mtime=0)
+
+
+# responses are cached compressed for the client's encoding, so a hit is sent as it is;
+# Content-Encoding is set here, which makes the compression middleware leave them alone
+def _cached_response(request, dataset, cache_key, build):
+    requested = _response_encoding(request)
+    cached = dataset.search_cache.get((cache_key, requested))
+    if cached is None:
+        body, etag = build()
+        encoding = requested if len(body) >= MIN_COMPRESS_SIZE else None
+        if encoding is not None:
+            # another representation of the same data, so it gets its own ETag
+            body, etag = _compress(body, encoding), f'{etag[:-1]}-{encoding}"'
+        cached = body, etag, encoding
+        dataset.search_cache.put((cache_key, requested), cached, len(body))
+    body, etag, encoding = cached
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Data-Generation": str(dataset.generation),
+        "X-Data-Version": dataset.version
+    }
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if_none_match = request.headers.get("if-none-match", "")
+    # weak comparison as in RFC 9110: a W/ prefix added by proxies does not matter
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# serialized response body and its ETag for a normalized query
+def _search_body(dataset, key, offset, limit, fields):
+    tags = key[0]
+    index = dataset.index
+    bits = _filter_bits(dataset, key)
+    return _with_etag(dataset, {
+        "generation": dataset.generation,
+        "version": dataset.version,
+        "tags": list(tags),
+        "total": index.count(bits),
+        "offset": offset,
+        "limit": limit,
+        "results": [_project(card_id, card, fields) for card_id, card in index.page(bits, offset, limit)]
+    })
+
+
+# top-k cards by cosine similarity to query_vector, restricted to the filtered cards
+def _ranked_body(dataset, key, query_vector, limit, fields, exclude_card=None, **extra):
+    embeddings = dataset.embeddings
+    rows = None
+    if any(key[:4]):
+        rows = embeddings.candidate_rows(_filter_bits(dataset, key))
+    exclude_row = embeddings.rows.get(exclude_card) if exclude_card else None
+    results = []
+    for position, score in embeddings.top_k(query_vector, limit, rows, exclude_row):
+        card_id = dataset.index.card_ids[position]
+        results.append(dict(_project(card_id, dataset.index.cards[position], fields), score=round(score, 4)))
+    return _with_etag(dataset, dict(
+        extra,
+        generation=dataset.generation,
+        version=dataset.version,
+        tags=list(key[0]),
+        candidates=len(embeddings.mapped_rows) if rows is None else len(rows),
+        limit=limit,
+        results=results
+    ))
+
+
+def _require_embeddings(dataset):
+    if dataset.embeddings is None:
+        raise HTTPException(status_code=503, detail="Keine Bild-Embeddings vorhanden (resources/card_embeddings.npy fehlt)")
+    return dataset.embeddings
+
+
+# CLIP text embedding of a free-text query; the text tower is loaded on first use
+def _encode_text(embeddings, text):
+    import model_registry
+    from image_preprocessing import get_processors
+    from tag_embeddings import encode_tags
+    model = model_registry.get("clip", embeddings.backend)
+    return encode_tags([text], model, get_processors()[0], model_registry.get_device())[0].numpy()
 
-with open("resources/card_tags_merged.json", "r", encoding="utf-8") as f:
-    CARD_DATA = json.load(f)
 
 @app.get("/search")
 def search_cards(
+        request: Request,
         tags: Optional[List[str]] = Query(default=[]),
         colors: Optional[List[str]] = Query(default=[]),
         type_contains: Optional[str] = None,
-        legal_in: Optional[str] = None
+        legal_in: Optional[str] = None,
+        limit: int = Query(default=100, ge=1, le=1000),
+        offset: int = Query(default=0, ge=0),
+        expand_aliases: bool = True,
+        fields: Optional[str] = Query(default=None, description="Kommagetrennte Feldliste, z.B. id,name,image_url")
 ):
-    results = []
-    for card_id, card in CARD_DATA.items():
-        if tags and not all(tag in card["tags"] for tag in tags):
-            continue
-        if colors and not (set(colors).intersection(set(card.get("colors") or []))):
-            continue
-        if type_contains and type_contains.lower() not in (card.get("type_line") or "").lower():
-            continue
-        if legal_in and (card.get("legalities") or {}).get(legal_in.lower()) != "legal":
-            continue
-        results.append(card)
-    return results
+    dataset = DATASET
+    projection = _parse_fields(fields)
+    key = _query_key(dataset, tags, colors, type_contains, legal_in, expand_aliases)
+    return _cached_response(request, dataset, ("search", key, offset, limit, projection),
+                            lambda: _search_body(dataset, key, offset, limit, projection))
+
+
+@app.get("/similar/{card_id}")
+def similar_cards(
+        request: Request,
+        card_id: str,
+        tags: Optional[List[str]] = Query(default=[]),
+        colors: Optional[List[str]] = Query(default=[]),
+        type_contains: Optional[str] = None,
+        legal_in: Optional[str] = None,
+        limit: int = Query(default=20, ge=1, le=200),
+        expand_aliases: bool = True,
+        fields: Optional[str] = None
+):
+    dataset = DATASET
+    embeddings = _require_embeddings(dataset)
+    if dataset.index.position(card_id) is None:
+        raise HTTPException(status_code=404, detail=f"Karte {card_id} nicht gefunden")
+    vector = embeddings.vector(card_id)
+    if vector is None:
+        raise HTTPException(status_code=404, detail=f"Kein Bild-Embedding für {card_id}")
+    projection = _parse_fields(fields)
+    key = _query_key(dataset, tags, colors, type_contains, legal_in, expand_aliases)
+    return _cached_response(request, dataset, ("similar", card_id, key, limit, projection),
+                            lambda: _ranked_body(dataset, key, vector, limit, projection, exclude_card=card_id, card_id=card_id))
+
+
+@app.get("/search/text")
+def search_text(
+        request: Request,
+        q: str = Query(min_length=1),
+        tags: Optional[List[str]] = Query(default=[]),
+        colors: Optional[List[str]] = Query(default=[]),
+        type_contains: Optional[str] = None,
+        legal_in: Optional[str] = None,
+        limit: int = Query(default=20, ge=1, le=200),
+        expand_aliases: bool = True,
+        fields: Optional[str] = None
+):
+    dataset = DATASET
+    embeddings = _require_embeddings(dataset)
+    if len(q) > MAX_TEXT_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Suchtext zu lang (maximal {MAX_TEXT_QUERY_LENGTH} Zeichen)")
+    projection = _parse_fields(fields)
+    query = " ".join(q.split())
+    key = _query_key(dataset, tags, colors, type_contains, legal_in, expand_aliases)
+    return _cached_response(request, dataset, ("text", query.lower(), key, limit, projection),
+                            lambda: _ranked_body(dataset, key, _encode_text(embeddings, query), limit, projection, q=query))
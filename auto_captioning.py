@@ -1,120 +1,254 @@
+import json
 import os
+import time
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel, BlipProcessor, BlipForConditionalGeneration
-import json
 import torch
-import gc
 
+import metrics
+import model_registry
 from nlp_processing import extract_tags_from_text_fields
-from tag_provider import TAGS
-
-# Setup: download and init models
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-
-blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
-clip_model.to(device)
-blip_model.to(device)
+from image_preprocessing import CLIP_MODEL_NAME, BLIP_MODEL_NAME, get_processors, load_image, preprocess_image
+from result_store import ResultStore
+from tag_embeddings import as_features, get_tag_embeddings, score_tags
+from tag_matcher import get_tag_matcher
+from tag_provider import get_tags
+
+# models are loaded by the registry on first use (see model_registry.warmup)
+_LAZY_ATTRIBUTES = {
+    "clip_model": lambda: model_registry.get("clip"),
+    "blip_model": lambda: model_registry.get("blip"),
+    "clip_processor": lambda: get_processors()[0],
+    "blip_processor": lambda: get_processors()[1],
+    "device": model_registry.get_device,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+BLIP_GENERATE_KWARGS = dict(
+    max_new_tokens=100,
+    num_beams=5,
+    do_sample=True,
+    top_k=50,
+    top_p=0.95,
+    repetition_penalty=1.2
+)
+
+# Score an image against the cached tag embeddings (text tower runs only for new tags)
+def clip_tags_for_image(image, tags):
+    clip_model, device = model_registry.get("clip"), model_registry.get_device()
+    clip_processor = get_processors()[0]
+    tag_matrix = get_tag_embeddings(tags, clip_model, clip_processor, model_registry.model_key(CLIP_MODEL_NAME), device)
+    with torch.inference_mode():
+        inputs = clip_processor(images=image, return_tensors="pt").to(device)
+        image_features = as_features(clip_model.get_image_features(**inputs))
+        return score_tags(image_features, tag_matrix, clip_model.logit_scale.exp(), tags)[0]
+
+# accepts a path or an already decoded image, so callers can decode once for both models
+def _as_image(img):
+    if isinstance(img, Image.Image):
+        return img
+    return load_image(img)
 
 # Function to tag images using CLIP
-def tag_image(img_path, tags=TAGS):
-    image = Image.open(img_path).convert("RGB")
-    inputs = clip_processor(text=tags, images=image, return_tensors="pt", padding=True)
-    outputs = clip_model(**inputs)
-    logits_per_image = outputs.logits_per_image[0]
-    probs = logits_per_image.softmax(dim=0)
-    scored_tags = [(tag, float(probs[i])) for i, tag in enumerate(tags)]
-    return [tag for tag, score in scored_tags if score > 0.15]
+def tag_image(img_path, tags=None):
+    image = _as_image(img_path)
+    return clip_tags_for_image(image, get_tags() if tags is None else tags)
 
 # Function to generate captions for images using BLIP
 def generate_caption(img_path):
-    image = Image.open(img_path).convert("RGB")
-    inputs = blip_processor(images=image, return_tensors="pt")
-    out = blip_model.generate(
-        **inputs,
-        max_new_tokens=100,
-        num_beams=5,
-        do_sample=True,
-        top_k=50,
-        top_p=0.95,
-        repetition_penalty=1.2
-    )
+    image = _as_image(img_path)
+    blip_model, device = model_registry.get("blip"), model_registry.get_device()
+    blip_processor = get_processors()[1]
+    inputs = blip_processor(images=image, return_tensors="pt").to(device)
+    with torch.inference_mode():
+        out = blip_model.generate(**inputs, **BLIP_GENERATE_KWARGS)
     caption = blip_processor.decode(out[0], skip_special_tokens=True)
     return caption
 
 # Function to caption all images in a directory
 def caption_all_images(img_dir, output_path="resources/card_captions.json"):
-    existing = {}
-    if os.path.exists(output_path):
-        with open(output_path, 'r', encoding='utf-8') as f:
-            existing = json.load(f)
-
-    results = existing.copy()
-    for file in os.listdir(img_dir):
-        if file.endswith(".jpg"):
-            path = os.path.join(img_dir, file)
-            card_id = file.replace(".jpg", "")
-            if card_id in existing:
-                continue
-            try:
-                caption = generate_caption(path)
-                results[card_id] = caption
-            except Exception as e:
-                print(f"Fehler bei {file}: {e}")
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
+    with ResultStore(output_path) as store:
+        existing = store.ids()
+        for file in os.listdir(img_dir):
+            if file.endswith(".jpg"):
+                path = os.path.join(img_dir, file)
+                card_id = file.replace(".jpg", "")
+                if card_id in existing:
+                    continue
+                try:
+                    store.put(card_id, generate_caption(path))
+                except Exception as e:
+                    print(f"Fehler bei {file}: {e}")
+
+        store.compact()
+
+
+def build_card_record(card_data, tags, auto_tags, text_tags, caption):
+    return {
+        "name": card_data.get("name"),
+        "colors": card_data.get("colors"),
+        "type_line": card_data.get("type_line"),
+        "oracle_text": card_data.get("oracle_text"),
+        "legalities": card_data.get("legalities"),
+        "image_url": card_data.get("image_uris", {}).get("normal"),
+        "tags": tags,
+        "auto_tags": auto_tags,
+        "text_tags": text_tags,
+        "caption": caption
+    }
+
+
+# model keys of the inference cache: they include the backend, and for captions the generation parameters
+def clip_cache_key(backend=None):
+    return model_registry.model_key(CLIP_MODEL_NAME, backend)
+
+
+def blip_cache_key(backend=None):
+    return f"{model_registry.model_key(BLIP_MODEL_NAME, backend)}|{json.dumps(BLIP_GENERATE_KWARGS, sort_keys=True)}"
+
+
+# cached outputs a worker did not see yet (written by earlier batches of the same run)
+def _fill_from_cache(values, hashes, lookup):
+    missing = [digest for digest, value in zip(hashes, values) if value is None and digest]
+    if not missing:
+        return values
+    found = lookup(missing)
+    return [found.get(digest) if value is None and digest else value for digest, value in zip(hashes, values)]
+
+
+# positions still missing a value, grouped by image hash so identical art runs through a model once
+def _missing_groups(values, hashes):
+    groups = {}
+    for i, (digest, value) in enumerate(zip(hashes, values)):
+        if value is None:
+            groups.setdefault(digest or i, []).append(i)
+    return groups
+
+
+# CLIP image embeddings and BLIP captions for a micro-batch; only images without cached
+# outputs go through the models, new outputs are written to the cache
+def infer_batch(batch, cache=None, backend=None):
+    loaded = [pixels for _, pixels in batch]
+    hashes = [entry.get("hash") for entry in loaded]
+    embeddings = [entry.get("clip_embedding") for entry in loaded]
+    captions = [entry.get("caption") for entry in loaded]
+    if cache is not None:
+        cache.remember_file_hashes([(item[1], digest) for (item, _), digest in zip(batch, hashes) if digest])
+        with metrics.timer("cache_lookup", len(batch)):
+            embeddings = _fill_from_cache(embeddings, hashes, lambda missing: cache.get_embeddings(missing, clip_cache_key(backend)))
+            captions = _fill_from_cache(captions, hashes, lambda missing: cache.get_captions(missing, blip_cache_key(backend)))
+    metrics.count("clip_cache_hits", sum(embedding is not None for embedding in embeddings))
+    metrics.count("caption_cache_hits", sum(caption is not None for caption in captions))
+
+    device = model_registry.get_device()
+    with torch.inference_mode():
+        groups = _missing_groups(embeddings, hashes)
+        if groups:
+            clip_model = model_registry.get("clip", backend)
+            with metrics.timer("clip_forward", len(groups)):
+                clip_pixels = torch.stack([loaded[positions[0]]["clip"] for positions in groups.values()]).to(device)
+                # rounded like the cached float16 vectors, so cached and fresh images score the same
+                features = as_features(clip_model.get_image_features(pixel_values=clip_pixels)).half().float().cpu()
+            for positions, feature in zip(groups.values(), features):
+                for i in positions:
+                    embeddings[i] = feature
+            if cache is not None:
+                cache.put_embeddings([(key, feature) for key, feature in zip(groups, features) if isinstance(key, str)], clip_cache_key(backend))
+
+        groups = _missing_groups(captions, hashes)
+        if groups:
+            blip_model = model_registry.get("blip", backend)
+            with metrics.timer("blip_generate", len(groups)):
+                blip_pixels = torch.stack([loaded[positions[0]]["blip"] for positions in groups.values()]).to(device)
+                out = blip_model.generate(pixel_values=blip_pixels, **BLIP_GENERATE_KWARGS)
+                new_captions = get_processors()[1].batch_decode(out, skip_special_tokens=True)
+            for positions, caption in zip(groups.values(), new_captions):
+                for i in positions:
+                    captions[i] = caption
+            if cache is not None:
+                cache.put_captions([(key, caption) for key, caption in zip(groups, new_captions) if isinstance(key, str)], blip_cache_key(backend))
+    return embeddings, captions
+
+
+# tag lists for CLIP image embeddings against the current vocabulary
+def score_embeddings(embeddings, tags, backend=None):
+    clip_model, device = model_registry.get("clip", backend), model_registry.get_device()
+    tag_matrix = get_tag_embeddings(tags, clip_model, get_processors()[0], clip_cache_key(backend), device)
+    with torch.inference_mode():
+        return score_tags(torch.stack(embeddings).to(device), tag_matrix, clip_model.logit_scale.exp(), tags)
+
+
+# run CLIP and BLIP on a whole micro-batch of ((card_id, path), pixels) entries;
+# text_tags holds precomputed text tags per card id (see auto_tagging.tag_text_fields)
+def process_batch(batch, tags, card_db, text_tags=None, cache=None):
+    embeddings, captions = infer_batch(batch, cache)
+    with metrics.timer("clip_scoring", len(batch)):
+        tag_results = score_embeddings(embeddings, tags)
+
+    matcher = get_tag_matcher(tags)
+    results = []
+    for ((card_id, _), _), tag_result, caption in zip(batch, tag_results, captions):
+        card_data = card_db.get(card_id, {})
+        with metrics.timer("caption_matching"):
+            auto_tags = matcher.find(caption)
+        card_text_tags = text_tags.get(card_id) if text_tags is not None else None
+        if card_text_tags is None:
+            with metrics.timer("nlp_extraction"):
+                card_text_tags = extract_tags_from_text_fields(card_data)
+        results.append(build_card_record(card_data, tag_result, auto_tags, card_text_tags, caption))
+    return results
 
 
 def process_card(card_id, path, card_data, tags):
     try:
-        with Image.open(path) as img:
-            image = img.convert("RGB")
-
-        clip_inputs = clip_processor(text=tags, images=image, return_tensors="pt", padding=True)
-        for k in clip_inputs:
-            clip_inputs[k] = clip_inputs[k].to(device)
-        clip_outputs = clip_model(**clip_inputs)
-        probs = clip_outputs.logits_per_image[0].softmax(dim=0)
-        scored_tags = [(tag, float(probs[i])) for i, tag in enumerate(tags)]
-        tag_result = [tag for tag, score in scored_tags if score > 0.15]
-
-        blip_inputs = blip_processor(images=image, return_tensors="pt").to(device)
-        out = blip_model.generate(
-            **blip_inputs,
-            max_new_tokens=100,
-            num_beams=5,
-            do_sample=True,
-            top_k=50,
-            top_p=0.95,
-            repetition_penalty=1.2
-        )
-        caption = blip_processor.decode(out[0], skip_special_tokens=True)
-
-        auto_tags = [t for t in tags if t.lower() in caption.lower()]
-        text_tags = extract_tags_from_text_fields(card_data)
-
-        del image, clip_inputs, clip_outputs, blip_inputs, out
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-
-        return card_id, {
-            "name": card_data.get("name"),
-            "colors": card_data.get("colors"),
-            "type_line": card_data.get("type_line"),
-            "oracle_text": card_data.get("oracle_text"),
-            "legalities": card_data.get("legalities"),
-            "image_url": card_data.get("image_uris", {}).get("normal"),
-            "tags": tag_result,
-            "auto_tags": auto_tags,
-            "text_tags": text_tags,
-            "caption": caption
-        }
+        entry = ((card_id, path), preprocess_image(path))
+        return card_id, process_batch([entry], tags, {card_id: card_data})[0]
     except Exception as e:
         print(f"❌ Fehler bei {card_id}: {e}")
+        metrics.failure("process_card", e, card_id)
         return card_id, None
 
+
+def _jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+# compares tags and captions of a backend with the fp32 baseline on sample images; captions are
+# sampled (do_sample), so both runs use the same seed
+def check_backend_accuracy(image_paths, tags, backend="int8", batch_size=8, seed=0):
+    batch = [((os.path.basename(path), path), preprocess_image(path)) for path in image_paths]
+    runs = {}
+    for name in ("fp32", backend):
+        # loading/quantizing is not part of the timing
+        model_registry.get("clip", name)
+        model_registry.get("blip", name)
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        embeddings, captions = [], []
+        for offset in range(0, len(batch), batch_size):
+            batch_embeddings, batch_captions = infer_batch(batch[offset:offset + batch_size], backend=name)
+            embeddings += batch_embeddings
+            captions += batch_captions
+        seconds = time.perf_counter() - start
+        runs[name] = (embeddings, score_embeddings(embeddings, tags, name), captions, seconds)
+
+    base, other = runs["fp32"], runs[backend]
+    count = max(1, len(batch))
+    return {
+        "backend": backend,
+        "images": len(batch),
+        "embedding_cosine": sum(torch.nn.functional.cosine_similarity(a, b, dim=0).item()
+                                for a, b in zip(base[0], other[0])) / count,
+        "tag_jaccard": sum(_jaccard(a, b) for a, b in zip(base[1], other[1])) / count,
+        "tags_identical": sum(a == b for a, b in zip(base[1], other[1])) / count,
+        "caption_identical": sum(a == b for a, b in zip(base[2], other[2])) / count,
+        "caption_token_jaccard": sum(_jaccard(a.split(), b.split()) for a, b in zip(base[2], other[2])) / count,
+        "seconds_fp32": base[3],
+        f"seconds_{backend}": other[3],
+        "speedup": base[3] / other[3] if other[3] else None
+    }
@@ -1,17 +1,30 @@
 import json
 import os
+import time
+from functools import partial
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import multiprocessing
 
-from auto_captioning import tag_image, generate_caption, process_card
-from nlp_processing import extract_tags_from_text_fields
-from tag_provider import TAGS, load_tags
+from auto_captioning import (tag_image, generate_caption, process_batch, build_card_record, score_embeddings,
+                             clip_cache_key, blip_cache_key)
+from image_preprocessing import init_worker, load_image
+from inference_cache import InferenceCache, preprocess_item_cached
+from inference_pipeline import run_batched
+import metrics
+import model_registry
+from nlp_processing import extract_tags_from_text_fields, extract_text_tags_bulk
+from result_store import ResultStore, store_path_for
+from scryfall_bulk import BulkCardLookup, iter_bulk_cards
+from sharding import LEASE_SECONDS, WorkQueue, default_node_name, iter_claimed, partial_output_path, shard_of
+from tag_matcher import get_tag_matcher, match_tags
+from tag_provider import get_tags, load_tags
+
+TEXT_TAGS_PATH = "resources/card_text_tags.json"
+# longest pause of a queue node while other nodes still hold claims
+QUEUE_POLL_SECONDS = 10
 
 
 def extract_tags_from_caption(caption, known_tags):
-    caption_lower = caption.lower()
-    return [tag for tag in known_tags if tag.lower() in caption_lower]
+    return match_tags(caption, known_tags)
 
 
 def auto_tag_from_captions(caption_path="resources/card_captions.json", output_path="resources/card_auto_tags.json"):
@@ -19,80 +32,224 @@ def auto_tag_from_captions(caption_path="resources/card_captions.json", output_p
         captions = json.load(f)
     auto_tags = {}
     for card_id, caption in captions.items():
-        auto_tags[card_id] = extract_tags_from_caption(caption, TAGS)
+        auto_tags[card_id] = extract_tags_from_caption(caption, get_tags())
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(auto_tags, f, indent=2)
 
 
 def tag_all_images(img_dir, tag_output_path, merged_output_path, bulk_json_path):
-    with open(bulk_json_path, 'r', encoding='utf-8') as f:
-        cards = {card['id']: card for card in json.load(f)}
-
-    existing = {}
-    if os.path.exists(merged_output_path):
-        with open(merged_output_path, 'r', encoding='utf-8') as f:
-            existing = json.load(f)
-
-    tagged_results = {}
-    merged_results = existing.copy()
-
-    for file in tqdm(os.listdir(img_dir)):
-        if file.endswith(".jpg"):
-            path = os.path.join(img_dir, file)
-            card_id = file.replace(".jpg", "")
-            if card_id in existing:
-                continue
-            tags = tag_image(path)
-            caption = generate_caption(path)
-            auto_tags = extract_tags_from_caption(caption, TAGS)
-            card_data = cards.get(card_id, {})
-            text_tags = extract_tags_from_text_fields(card_data)
-            tagged_results[card_id] = tags
-            merged_results[card_id] = {
-                "name": card_data.get("name"),
-                "colors": card_data.get("colors"),
-                "type_line": card_data.get("type_line"),
-                "oracle_text": card_data.get("oracle_text"),
-                "legalities": card_data.get("legalities"),
-                "image_url": card_data.get("image_uris", {}).get("normal"),
-                "tags": tags,
-                "auto_tags": auto_tags,
-                "text_tags": text_tags,
-                "caption": caption
-            }
-
-    with open(tag_output_path, 'w', encoding='utf-8') as f:
-        json.dump(tagged_results, f, indent=2)
-
-    with open(merged_output_path, 'w', encoding='utf-8') as f:
-        json.dump(merged_results, f, indent=2)
-
-
-def tag_all_parallel(img_dir, bulk_json_path, output_path="resources/card_tags_merged.json", max_workers=None):
+    with BulkCardLookup(bulk_json_path) as cards, \
+            ResultStore(tag_output_path) as tag_store, ResultStore(merged_output_path) as merged_store:
+        existing = merged_store.ids()
+        for file in tqdm(os.listdir(img_dir)):
+            if file.endswith(".jpg"):
+                path = os.path.join(img_dir, file)
+                card_id = file.replace(".jpg", "")
+                if card_id in existing:
+                    continue
+                image = load_image(path)
+                tags = tag_image(image)
+                caption = generate_caption(image)
+                auto_tags = extract_tags_from_caption(caption, get_tags())
+                card_data = cards.get(card_id, {})
+                text_tags = extract_tags_from_text_fields(card_data)
+                tag_store.put(card_id, tags)
+                merged_store.put(card_id, build_card_record(card_data, tags, auto_tags, text_tags, caption))
+
+        tag_store.compact()
+        merged_store.compact()
+
+
+# separate text pass: text tags for all cards (or only card_ids) from the bulk data, stored incrementally
+def tag_text_fields(bulk_json_path, output_path=TEXT_TAGS_PATH, card_ids=None, n_process=1, batch_size=256):
+    lookup = None
+    with ResultStore(output_path) as store:
+        done = store.ids()
+        if card_ids is None:
+            cards = ((card['id'], card) for card in iter_bulk_cards(bulk_json_path) if card['id'] not in done)
+            total = None
+        else:
+            lookup = BulkCardLookup(bulk_json_path)
+            todo = [cid for cid in card_ids if cid not in done]
+            cards = ((cid, lookup.get(cid, {})) for cid in todo)
+            total = len(todo)
+
+        pending = []
+        count = 0
+        write_seconds = 0.0
+        start = time.perf_counter()
+        for entry in tqdm(extract_text_tags_bulk(cards, batch_size=batch_size, n_process=n_process), total=total, desc="📝 Text-Tags"):
+            pending.append(entry)
+            count += 1
+            if len(pending) >= 1000:
+                write_start = time.perf_counter()
+                store.put_many(pending)
+                write_seconds += time.perf_counter() - write_start
+                pending = []
+        write_start = time.perf_counter()
+        store.put_many(pending)
+        write_seconds += time.perf_counter() - write_start
+        metrics.observe("nlp_extraction", time.perf_counter() - start - write_seconds, count)
+        metrics.observe("text_write", write_seconds, count)
+    if lookup is not None:
+        lookup.close()
+
+
+# queue mode: a node does not know its cards in advance, so the text tags of each claimed chunk
+# are extracted in one bulk pass into text_tags before the chunk's images are loaded. Runs in the
+# pipeline's producer thread, so it opens its own bulk lookup.
+def iter_claimed_with_text_tags(queue_path, node, img_dir, chunk_size, bulk_json_path, text_tags):
+    lookup = BulkCardLookup(bulk_json_path)
+
+    def extract(card_ids):
+        with metrics.timer("nlp_extraction", len(card_ids)):
+            text_tags.update(extract_text_tags_bulk((cid, lookup.get(cid, {})) for cid in card_ids))
+
+    try:
+        yield from iter_claimed(queue_path, node, img_dir, chunk_size, on_claim=extract)
+    finally:
+        lookup.close()
+
+
+# the run report (per-stage timings, queue depths, failures, peak memory) is written to
+# resources/reports; metrics_port serves the same numbers for Prometheus while the run is going.
+# Several nodes can share a run: with shards > 1 this node only tags the cards of shard
+# (0-based, by card-id hash), with queue_path it claims cards from a shared WorkQueue. Either
+# way the results go to a partial store next to output_path; merge_partial_results combines them.
+def tag_all_parallel(img_dir, bulk_json_path, output_path="resources/card_tags_merged.json", max_workers=None, batch_size=8, nlp_processes=1, threads=None, metrics_port=None,
+                     shard=None, shards=1, queue_path=None, node=None):
+    merged_path = output_path
+    text_tags_path = TEXT_TAGS_PATH
+    run_name = "tag_all_parallel"
+    if queue_path:
+        node = node or default_node_name()
+        output_path = partial_output_path(merged_path, node=node)
+        run_name += f"-{node}"
+    elif shards > 1:
+        if shard is None or not 0 <= shard < shards:
+            raise ValueError(f"Ungültiger Shard {shard} für {shards} Shards")
+        output_path = partial_output_path(merged_path, shard, shards)
+        # the text pass of a shard only writes its own store, too
+        text_tags_path = partial_output_path(TEXT_TAGS_PATH, shard, shards)
+        run_name += f"-shard-{shard}-of-{shards}"
+
+    run = metrics.start_run(run_name)
+    server = metrics.serve(metrics_port) if metrics_port else None
     tags = load_tags()
-    with open(bulk_json_path, 'r', encoding='utf-8') as f:
-        card_db = {c['id']: c for c in json.load(f)}
-
-    existing = {}
-    if os.path.exists(output_path):
-        with open(output_path, 'r', encoding='utf-8') as f:
-            existing = json.load(f)
+    card_db = BulkCardLookup(bulk_json_path)
+    store = ResultStore(output_path)
+    existing = store.ids()
+    if output_path != merged_path and os.path.exists(store_path_for(merged_path)):
+        with ResultStore(merged_path) as merged:
+            existing |= merged.ids()
 
     img_files = [f for f in os.listdir(img_dir) if f.endswith(".jpg")]
     todo = [(f.replace(".jpg", ""), os.path.join(img_dir, f)) for f in img_files if f.replace(".jpg", "") not in existing]
+    if shards > 1 and not queue_path:
+        todo = [(cid, path) for cid, path in todo if shard_of(cid, shards) == shard]
+    del existing
 
-    merged = existing.copy()
     if max_workers is None:
-        max_workers = min(8, multiprocessing.cpu_count())
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_card, cid, path, card_db.get(cid, {}), tags) for cid, path in todo]
-        for future in tqdm(as_completed(futures), total=len(futures), desc="🔍 Tagging"):
-            cid, result = future.result()
+        max_workers = model_registry.default_workers()
+
+    # queue nodes extract the text tags per claimed chunk instead (see iter_claimed_with_text_tags)
+    if not queue_path:
+        tag_text_fields(bulk_json_path, text_tags_path, card_ids=[cid for cid, _ in todo], n_process=nlp_processes)
+    text_tags = ResultStore(text_tags_path)
+    cache = InferenceCache()
+    threads = model_registry.configure_threads(max_workers, threads)
+    if todo or queue_path:
+        # load both models before the worker processes start
+        with metrics.timer("model_load", 0):
+            model_registry.warmup("clip", "blip")
+
+    def write_results(items, total, text_tags, work=None):
+        results = run_batched(
+            items,
+            partial(preprocess_item_cached, cache_path=cache.path, clip_key=clip_cache_key(), blip_key=blip_cache_key()),
+            lambda batch: process_batch(batch, tags, card_db, text_tags, cache),
+            batch_size=batch_size,
+            max_workers=max_workers,
+            initializer=init_worker
+        )
+        renewed = time.monotonic()
+        for (cid, _), result in tqdm(results, total=total, desc="🔍 Tagging"):
             if result:
-                merged[cid] = result
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(merged, f, indent=2)
-
-    print(f"✅ {len(todo)} Karten verarbeitet und gespeichert (parallel mit {max_workers} Threads).")
+                with metrics.timer("write"):
+                    store.put(cid, result)
+                run.count("cards_done")
+                if work is not None:
+                    work.complete(node, [cid])
+            else:
+                run.count("cards_failed")
+                if work is not None:
+                    work.fail(node, cid)
+            if work is not None:
+                text_tags.pop(cid, None)
+            if work is not None and time.monotonic() - renewed > LEASE_SECONDS / 3:
+                work.renew(node)
+                renewed = time.monotonic()
+
+    try:
+        with card_db, store, text_tags, cache:
+            if queue_path:
+                with WorkQueue(queue_path) as work:
+                    work.add(cid for cid, _ in todo)
+                    claimed_text_tags = {}
+                    while True:
+                        claimed = iter_claimed_with_text_tags(queue_path, node, img_dir, max(batch_size, max_workers) * 4,
+                                                              bulk_json_path, claimed_text_tags)
+                        write_results(claimed, None, claimed_text_tags, work)
+                        # other nodes still hold claims: wait whether they finish or their leases expire
+                        wait = work.wait_seconds(node)
+                        if wait is None:
+                            break
+                        time.sleep(min(wait, QUEUE_POLL_SECONDS))
+                    print(f"📋 Warteschlange {queue_path}: {work.counts()}")
+            else:
+                write_results(todo, len(todo), text_tags)
+
+            with metrics.timer("compact", len(store)):
+                store.compact()
+    except Exception:
+        # the run stopped early, e.g. a preprocessing worker died; keep the report of what happened
+        print(f"📊 Laufbericht (abgebrochen): {run.write_report()}")
+        if server is not None:
+            server.shutdown()
+        raise
+
+    done = run.counters.get("cards_done", 0) + run.counters.get("cards_failed", 0)
+    print(f"✅ {done} Karten verarbeitet und gespeichert (Batchgröße {batch_size}, {max_workers} Vorverarbeitungs-Prozesse, "
+          f"{threads} Inferenz-Threads, Backend {model_registry.get_backend()}).")
+    run.print_summary()
+    print(f"📊 Laufbericht: {run.write_report()}")
+    if server is not None:
+        server.shutdown()
+
+
+# re-scores tags and auto_tags of all stored cards from cached CLIP embeddings and captions,
+# e.g. after tags.json changed; cards without cached outputs are left as they are
+def rescore_tags(img_dir, output_path="resources/card_tags_merged.json", batch_size=256):
+    tags = load_tags()
+    matcher = get_tag_matcher(tags)
+    rescored = skipped = 0
+    with ResultStore(output_path) as store, InferenceCache() as cache:
+        for batch in tqdm(store.batches(batch_size), desc="🔁 Neubewertung"):
+            hashes = {}
+            for card_id, _ in batch:
+                path = os.path.join(img_dir, f"{card_id}.jpg")
+                if os.path.exists(path):
+                    hashes[card_id] = cache.file_hash(path)
+            embeddings = cache.get_embeddings(hashes.values(), clip_cache_key())
+            ready = [(card_id, card) for card_id, card in batch if hashes.get(card_id) in embeddings]
+            skipped += len(batch) - len(ready)
+            if not ready:
+                continue
+            tag_results = score_embeddings([embeddings[hashes[card_id]] for card_id, _ in ready], tags)
+            for (card_id, card), tag_result in zip(ready, tag_results):
+                card["tags"] = tag_result
+                card["auto_tags"] = matcher.find(card.get("caption") or "")
+            store.put_many(ready)
+            rescored += len(ready)
+        store.compact()
+    print(f"✅ {rescored} Karten aus dem Inferenz-Cache neu bewertet ({skipped} ohne Cache-Eintrag übersprungen).")
@@ -0,0 +1,495 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+from types import SimpleNamespace
+
+# Benchmarks for the hot paths of the pipeline. Every case runs in its own process so the
+# reported peak RSS belongs to that case only. CLIP and BLIP are replaced by stand-ins with a
+# fixed cost, so the numbers measure our code (batching, decoding, indexing) and not the models.
+
+WORDS = [
+    "dragon", "angel", "demon", "goblin", "elf", "wizard", "knight", "zombie", "vampire", "beast",
+    "sword", "shield", "fire", "flame", "ice", "storm", "forest", "mountain", "island", "swamp",
+    "plains", "sky", "sea", "river", "castle", "tower", "ruins", "city", "battle", "war",
+    "spirit", "ghost", "shadow", "light", "darkness", "sun", "moon", "star", "night", "dawn",
+    "blood", "bone", "skull", "crown", "throne", "king", "queen", "soldier", "army", "warrior",
+    "horse", "wolf", "bear", "snake", "bird", "eagle", "cat", "spider", "insect", "fish",
+    "tree", "flower", "vine", "root", "stone", "crystal", "gold", "metal", "machine", "artifact",
+    "magic", "spell", "rune", "book", "scroll", "staff", "wand", "potion", "cloak", "armor",
+    "ocean", "wave", "wind", "cloud", "lightning", "thunder", "rain", "snow", "desert", "cave",
+    "giant", "dwarf", "troll", "ogre", "golem", "elemental", "horror", "hydra", "phoenix", "sphinx",
+]
+TYPE_LINES = [
+    "Creature — Elf Warrior", "Legendary Creature — Dragon", "Creature — Human Wizard", "Instant",
+    "Sorcery", "Artifact — Equipment", "Basic Land — Forest", "Enchantment — Aura",
+    "Legendary Planeswalker — Jace", "Artifact Creature — Golem", "Land", "Tribal Instant — Goblin",
+]
+COLORS = [None, [], ["W"], ["U"], ["B"], ["R"], ["G"], ["U", "B"], ["R", "G"], ["W", "U", "B", "R", "G"]]
+FORMATS = ["standard", "pioneer", "modern", "legacy", "vintage", "commander", "pauper", "historic"]
+
+
+class BenchmarkSkipped(Exception):
+    pass
+
+
+def make_tag_vocabulary(size):
+    vocab = list(WORDS)
+    i = 0
+    while len(vocab) < size:
+        vocab.append(f"{WORDS[i % len(WORDS)]} {WORDS[(i * 7 + 3) % len(WORDS)]}")
+        i += 1
+    return list(dict.fromkeys(vocab))[:size]
+
+
+# synthetic cards in the shape of card_tags_merged.json
+def make_cards(n, seed=0, vocab_size=2000):
+    rng = random.Random(seed)
+    vocab = make_tag_vocabulary(vocab_size)
+    cards = {}
+    for i in range(n):
+        flavor = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))
+        cards[f"{i:08x}-0000-0000-0000-{seed:012x}"] = {
+            "name": f"{rng.choice(WORDS).title()} of the {rng.choice(WORDS).title()}",
+            "colors": rng.choice(COLORS),
+            "type_line": rng.choice(TYPE_LINES),
+            "oracle_text": "Flying. When this enters the battlefield, draw a card." * rng.randint(1, 3),
+            "flavor_text": f"The {flavor}.",
+            "legalities": {fmt: rng.choice(["legal", "not_legal", "banned"]) for fmt in FORMATS},
+            "image_url": f"https://cards.example/{i}.jpg",
+            "tags": rng.sample(vocab[:300], rng.randint(1, 8)),
+            "auto_tags": rng.sample(vocab, rng.randint(0, 4)),
+            "text_tags": rng.sample(vocab, rng.randint(0, 6)),
+            "caption": f"a painting of a {rng.choice(WORDS)} with a {rng.choice(WORDS)}",
+        }
+    return cards
+
+
+def make_queries(cards, count, seed=1):
+    rng = random.Random(seed)
+    tags = sorted({tag for card in cards.values() for tag in card["tags"]})
+    queries = []
+    for _ in range(count):
+        queries.append({
+            "tags": rng.sample(tags, rng.randint(1, 3)),
+            "colors": rng.sample(["W", "U", "B", "R", "G"], rng.randint(0, 2)),
+            "type_contains": rng.choice([None, None, "creature", "elf", "legendary creature", "art"]),
+            "legal_in": rng.choice([None, "modern", "Commander"]),
+        })
+    return queries
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": samples[len(samples) // 2] * 1e3,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e3,
+        "mean_ms": statistics.fmean(samples) * 1e3,
+    }
+
+
+def bench_search(cards, queries=2000, limit=100):
+    from search_index import CardIndex
+    data = make_cards(cards)
+    start = time.perf_counter()
+    index = CardIndex.from_cards(data)
+    build_s = time.perf_counter() - start
+
+    samples = []
+    for query in make_queries(data, queries):
+        start = time.perf_counter()
+        bits = index.query(**query)
+        index.count(bits)
+        index.page(bits, 0, limit)
+        samples.append(time.perf_counter() - start)
+    return dict(_percentiles(samples), index_build_s=build_s, queries=queries)
+
+
+def bench_card_store(cards, queries=2000, limit=100):
+    from card_store import CardStore, open_card_index, write_card_store
+    data = make_cards(cards)
+    workdir = tempfile.mkdtemp(prefix="bench_store_")
+    try:
+        path = os.path.join(workdir, "cards.bin")
+        start = time.perf_counter()
+        write_card_store(data.items(), path)
+        write_s = time.perf_counter() - start
+        queries = make_queries(data, queries)
+        del data
+
+        start = time.perf_counter()
+        store = CardStore(path)
+        index = open_card_index(store)
+        open_ms = (time.perf_counter() - start) * 1e3
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            bits = index.query(**query)
+            index.count(bits)
+            [card for _, card in index.page(bits, 0, limit)]
+            samples.append(time.perf_counter() - start)
+        store.close()
+        return dict(_percentiles(samples), write_s=write_s, open_ms=open_ms, file_mb=os.path.getsize(path) / 2 ** 20)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_bulk_stream(cards):
+    from scryfall_bulk import iter_bulk_cards
+    workdir = tempfile.mkdtemp(prefix="bench_bulk_")
+    try:
+        path = os.path.join(workdir, "bulk.json")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for i, (card_id, card) in enumerate(make_cards(cards).items()):
+                bulk_card = dict(card, id=card_id, lang="en", prices={"usd": "0.10"}, image_uris={"normal": card["image_url"]})
+                f.write(("," if i else "") + json.dumps(bulk_card))
+            f.write("]")
+        size_mb = os.path.getsize(path) / 2 ** 20
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_bulk_cards(path))
+        elapsed = time.perf_counter() - start
+        return {"cards_per_s": count / elapsed, "file_mb": size_mb}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# /search through the FastAPI app (query, response cache, projection, serialization and
+# compression), first with cold and then with cached responses; the app serves a card store
+def bench_api_search(cards, queries=500, limit=100):
+    try:
+        from fastapi.testclient import TestClient
+    except ImportError as e:
+        raise BenchmarkSkipped(f"FastAPI-TestClient nicht verfügbar: {e}")
+    from card_store import card_store_path_for, write_card_store
+    data = make_cards(cards)
+    workdir = tempfile.mkdtemp(prefix="bench_api_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        os.makedirs("resources")
+        write_card_store(data.items(), card_store_path_for("resources/card_tags_merged.json"))
+        queries = make_queries(data, queries)
+        del data
+        os.environ["CARD_RELOAD_INTERVAL"] = "0"
+        import api
+        client = TestClient(api.app)
+
+        def run():
+            samples, size = [], 0
+            for query in queries:
+                # one tag only, so the pages are mostly full
+                params = {key: value for key, value in dict(query, tags=query["tags"][:1]).items() if value}
+                start = time.perf_counter()
+                response = client.get("/search", params=dict(params, limit=limit), headers={"Accept-Encoding": "gzip"})
+                samples.append(time.perf_counter() - start)
+                size += len(response.content)
+                response.raise_for_status()
+            return samples, size
+
+        cold, _ = run()
+        cached, size = run()
+        result = _percentiles(cold)
+        result.update({f"cached_{key}": value for key, value in _percentiles(cached).items()})
+        return dict(result, response_kb=size / len(queries) / 2 ** 10)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# Stand-ins for CLIP and BLIP with a fixed cost per forward pass plus a smaller cost per image.
+# They have the interfaces process_batch uses, so the benchmark runs the real preprocessing,
+# inference cache, tag scoring and caption matching of a tagging run with these models.
+class StandInClip:
+    def __init__(self, batch_cost, item_cost, dim=512):
+        import torch
+        generator = torch.Generator().manual_seed(0)
+        self.batch_cost = batch_cost
+        self.item_cost = item_cost
+        self.image_projection = torch.randn(3 * 8 * 8, dim, generator=generator)
+        self.token_embeddings = torch.randn(1000, dim, generator=generator)
+        self.logit_scale = torch.tensor(4.6052)
+        self.config = SimpleNamespace(projection_dim=dim, text_config=SimpleNamespace(max_position_embeddings=77))
+
+    def get_image_features(self, pixel_values):
+        import torch
+        time.sleep(self.batch_cost + self.item_cost * len(pixel_values))
+        pooled = torch.nn.functional.adaptive_avg_pool2d(pixel_values, 8).flatten(1)
+        return pooled @ self.image_projection
+
+    def get_text_features(self, input_ids, **kwargs):
+        return self.token_embeddings[input_ids].mean(dim=1)
+
+
+class StandInBlip:
+    def __init__(self, batch_cost, item_cost, length=8):
+        self.batch_cost = batch_cost
+        self.item_cost = item_cost
+        self.length = length
+
+    def generate(self, pixel_values, **kwargs):
+        import torch
+        time.sleep(self.batch_cost + self.item_cost * len(pixel_values))
+        seeds = (pixel_values.mean(dim=(1, 2, 3)) * 1e4).long().abs()
+        return torch.stack([(seeds * (i + 1) + i) % len(WORDS) for i in range(self.length)], dim=1)
+
+
+# resizes and normalizes like the HuggingFace image processors; text is hashed to token ids
+class StandInProcessor:
+    def __init__(self, size):
+        self.image_processor = SimpleNamespace(size={"height": size, "width": size})
+        self.size = size
+
+    def __call__(self, images=None, text=None, return_tensors="pt", max_length=77, **kwargs):
+        import numpy as np
+        import torch
+        if text is not None:
+            ids = [[hash(word) % 1000 for word in t.split()][:max_length] for t in text]
+            width = max(len(row) for row in ids)
+            return {"input_ids": torch.tensor([row + row[:1] * (width - len(row)) for row in ids])}
+        pixels = np.asarray(images.resize((self.size, self.size)), dtype=np.float32) / 255.0
+        pixels = (pixels - 0.5) / 0.25
+        return {"pixel_values": torch.from_numpy(pixels).permute(2, 0, 1).unsqueeze(0)}
+
+    def batch_decode(self, ids, skip_special_tokens=True):
+        return ["a painting of " + " ".join(WORDS[i] for i in row.tolist()) for row in ids]
+
+
+def _install_stand_in_processors():
+    import image_preprocessing
+    image_preprocessing._processors = (StandInProcessor(224), StandInProcessor(384))
+
+
+# initializer of the preprocessing workers, instead of image_preprocessing.init_worker
+def _init_stand_in_worker():
+    import torch
+    torch.set_num_threads(1)
+    _install_stand_in_processors()
+
+
+def _write_images(workdir, images):
+    from PIL import Image
+    rng = random.Random(0)
+    todo = []
+    for i in range(images):
+        path = os.path.join(workdir, f"{i}.jpg")
+        Image.new("RGB", (488, 680), tuple(rng.randrange(256) for _ in range(3))).save(path, quality=90)
+        todo.append((f"{i:08x}-0000-0000-0000-{0:012x}", path))
+    return todo
+
+
+# run_batched with preprocess_item_cached and process_batch as in tag_all_parallel, the models
+# replaced by the stand-ins above; a second pass over the same images measures cache hits.
+# Text tags are precomputed like the text pass of a tagging run does (see the nlp case).
+def bench_pipeline(images, batch_size, workers, batch_cost=0.02, item_cost=0.002, vocab=1000):
+    try:
+        import torch  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError as e:
+        raise BenchmarkSkipped(f"torch/Pillow nicht installiert: {e}")
+    import model_registry
+    from auto_captioning import blip_cache_key, clip_cache_key, process_batch
+    from inference_cache import InferenceCache, preprocess_item_cached
+    from image_preprocessing import get_processors
+    from inference_pipeline import run_batched
+    from tag_embeddings import get_tag_embeddings
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    cwd = os.getcwd()
+    try:
+        # the tag embedding cache goes to resources/cache below the working directory
+        os.chdir(workdir)
+        model_registry.register("clip", lambda: StandInClip(batch_cost, item_cost))
+        model_registry.register("blip", lambda: StandInBlip(batch_cost, item_cost))
+        _install_stand_in_processors()
+        todo = _write_images(workdir, images)
+        card_db = dict(zip((card_id for card_id, _ in todo), make_cards(images).values()))
+        text_tags = {card_id: card["text_tags"] for card_id, card in card_db.items()}
+        tags = make_tag_vocabulary(vocab)
+
+        def run(cache):
+            load_fn = partial(preprocess_item_cached, cache_path=cache.path, clip_key=clip_cache_key(), blip_key=blip_cache_key())
+            start = time.perf_counter()
+            done = sum(1 for _, result in run_batched(
+                todo, load_fn, lambda batch: process_batch(batch, tags, card_db, text_tags, cache),
+                batch_size=batch_size, max_workers=workers, initializer=_init_stand_in_worker
+            ) if result is not None)
+            return done / (time.perf_counter() - start)
+
+        with InferenceCache(os.path.join(workdir, "inference_cache.sqlite")) as cache:
+            # encodes the tag vocabulary up front, so the first pass does not include it
+            get_tag_embeddings(tags, model_registry.get("clip"), get_processors()[0], clip_cache_key(), model_registry.get_device())
+            cold = run(cache)
+            warm = run(cache)
+        return {"images_per_s": cold, "cached_images_per_s": warm, "batch_cost_s": batch_cost, "item_cost_s": item_cost}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _import_nlp():
+    try:
+        import nlp_processing
+        nlp_processing.get_nlp()
+    except (ImportError, OSError) as e:
+        raise BenchmarkSkipped(f"nlp_processing nicht ladbar (spaCy-Modell): {e}")
+    return nlp_processing
+
+
+# the text pass of a tagging run (extract_text_tags_bulk, as in tag_text_fields) and, for
+# comparison, the per-card fallback; both start with an empty flavor-text memo
+def bench_nlp(cards, n_process=1):
+    nlp_processing = _import_nlp()
+    data = list(make_cards(cards).items())
+    nlp_processing._flavor_cache.clear()
+    start = time.perf_counter()
+    count = sum(1 for _ in nlp_processing.extract_text_tags_bulk(data, n_process=n_process))
+    bulk_s = time.perf_counter() - start
+
+    nlp_processing._flavor_cache.clear()
+    start = time.perf_counter()
+    for _, card in data:
+        nlp_processing.extract_tags_from_text_fields(card)
+    per_card_s = time.perf_counter() - start
+    return {"cards_per_s": count / bulk_s, "per_card_cards_per_s": len(data) / per_card_s}
+
+
+def bench_synonyms(vocab):
+    nlp_processing = _import_nlp()
+    tags = make_tag_vocabulary(vocab)
+    start = time.perf_counter()
+    groups = nlp_processing.build_synonym_map(tags, cache_path=None)
+    return {"build_s": time.perf_counter() - start, "groups": len(groups)}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _child(conn, fn, kwargs):
+    try:
+        metrics = fn(**kwargs)
+        metrics["peak_rss_mb"] = _peak_rss_mb()
+        conn.send(("ok", metrics))
+    except BenchmarkSkipped as e:
+        conn.send(("skipped", str(e)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def run_isolated(fn, **kwargs):
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_child, args=(sender, fn, kwargs))
+    process.start()
+    sender.close()
+    try:
+        status, payload = receiver.recv()
+    except EOFError:
+        status, payload = "error", f"Prozess beendet mit Code {process.exitcode}"
+    process.join()
+    return status, payload
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_cases(args):
+    cases = []
+    for n in args.sizes:
+        cases.append(("search", {"cards": n}, bench_search))
+        cases.append(("card_store", {"cards": n}, bench_card_store))
+        cases.append(("bulk_stream", {"cards": n}, bench_bulk_stream))
+        cases.append(("api_search", {"cards": n}, bench_api_search))
+    for batch_size in args.batch_sizes:
+        cases.append(("pipeline", {"images": args.images, "batch_size": batch_size, "workers": args.workers}, bench_pipeline))
+    cases.append(("nlp", {"cards": args.nlp_cards, "n_process": args.nlp_processes}, bench_nlp))
+    for vocab in args.vocab_sizes:
+        cases.append(("synonyms", {"vocab": vocab}, bench_synonyms))
+    if args.only:
+        cases = [case for case in cases if case[0] in args.only]
+    return cases
+
+
+def _case_key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+# prints relative changes of the shared metrics against an earlier result file
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {_case_key(result): result for result in json.load(f)["results"]}
+    print(f"\n📊 Vergleich mit {baseline_path}:")
+    for result in results:
+        old = baseline.get(_case_key(result))
+        if not old or result["status"] != "ok" or old["status"] != "ok":
+            continue
+        for metric, value in result["metrics"].items():
+            old_value = old["metrics"].get(metric)
+            if isinstance(value, (int, float)) and isinstance(old_value, (int, float)) and old_value:
+                change = (value - old_value) / old_value * 100
+                print(f"  {result['name']} {result['params']} {metric}: {old_value:.4g} → {value:.4g} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks für Tagging, NLP und Suche")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Kartenanzahl für Such-/Bulk-Benchmarks")
+    parser.add_argument("--images", type=int, default=200, help="Anzahl synthetischer Bilder für pipeline")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32], help="Batchgrößen für pipeline")
+    parser.add_argument("--workers", type=int, default=4, help="Vorverarbeitungs-Prozesse für pipeline")
+    parser.add_argument("--nlp-cards", type=int, default=1000, help="Kartenanzahl für den NLP-Benchmark")
+    parser.add_argument("--nlp-processes", type=int, default=1, help="Prozesse für extract_text_tags_bulk im NLP-Benchmark")
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[250, 500, 1000], help="Vokabulargrößen für die Synonym-Map")
+    parser.add_argument("--only", type=lambda s: s.split(","), default=None, help="Nur diese Benchmarks, z.B. search,nlp")
+    parser.add_argument("--output", type=str, default="bench_results.json", help="Ausgabedatei (JSON)")
+    parser.add_argument("--compare", type=str, default=None, help="Vorherige Ergebnisdatei zum Vergleich")
+    args = parser.parse_args()
+
+    results = []
+    for name, params, fn in build_cases(args):
+        print(f"⏱️  {name} {params} ...", flush=True)
+        status, payload = run_isolated(fn, **params)
+        result = {"name": name, "params": params, "status": status}
+        if status == "ok":
+            result["metrics"] = payload
+            print("   " + ", ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in payload.items()))
+        else:
+            result["reason"] = payload
+            print(f"   {status}: {payload}")
+        results.append(result)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Ergebnisse gespeichert in {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import json
+import mmap
+import os
+import struct
+
+from result_store import ResultStore, store_path_for
+from search_index import CardIndex, bits_from_positions, type_tokens
+
+MAGIC = b"MTGCARD1"
+# magic, directory offset, directory length
+HEADER = struct.Struct("<8sQQ")
+# (offset, length) into the string blob for id, name, type_line, oracle_text, image_url, caption;
+# (offset, count) into the tag id array for tags, auto_tags, text_tags;
+# two legality words (4 bits per format), colors (4 bits per color, in order), flags
+RECORD = struct.Struct("<12I6IQQIH")
+STRING_FIELDS = ["id", "name", "type_line", "oracle_text", "image_url", "caption"]
+TAG_FIELDS = ["tags", "auto_tags", "text_tags"]
+NONE_LENGTH = 0xFFFFFFFF
+FLAG_COLORS_NONE = 1
+FLAG_LEGALITIES_NONE = 2
+MAX_FORMATS = 32
+MAX_STATUSES = 15
+MAX_COLORS = 15
+MAX_CARD_COLORS = 8
+
+
+# resources/card_tags_merged.json -> resources/card_tags_merged.bin
+def card_store_path_for(json_path):
+    return os.path.splitext(json_path)[0] + ".bin"
+
+
+class _Interner:
+    def __init__(self, limit=None, name=""):
+        self.ids = {}
+        self.values = []
+        self.limit = limit
+        self.name = name
+
+    def __call__(self, value):
+        idx = self.ids.get(value)
+        if idx is None:
+            if self.limit is not None and len(self.values) >= self.limit:
+                raise ValueError(f"Zu viele Werte für {self.name} (max. {self.limit})")
+            idx = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+
+# writes the columnar store for (card_id, card) pairs; cards are stored sorted by id.
+# presorted=True streams pairs that already come in id order (e.g. ResultStore.items())
+def write_card_store(cards, out_path, presorted=False):
+    strings = bytearray()
+    records = bytearray()
+    tag_ids = []
+    tags = _Interner()
+    colors = _Interner(MAX_COLORS, "colors")
+    formats = _Interner(MAX_FORMATS, "formats")
+    statuses = _Interner(MAX_STATUSES, "legality status")
+    positions = {"tags": {}, "colors": {}, "legal": {}, "type": {}}
+    string_offsets = {}
+
+    def add_string(value):
+        if value is None:
+            return 0, NONE_LENGTH
+        data = value.encode("utf-8")
+        # interning keeps repeated values (reprints share names, type lines, texts) once in the blob
+        offset = string_offsets.get(data)
+        if offset is None:
+            offset = string_offsets[data] = len(strings)
+            strings.extend(data)
+        return offset, len(data)
+
+    count = 0
+    last_id = None
+    for i, (card_id, card) in enumerate(cards if presorted else sorted(cards, key=lambda item: item[0])):
+        if card_id == last_id:
+            raise ValueError(f"Doppelte Karten-ID {card_id}")
+        if last_id is not None and card_id < last_id:
+            raise ValueError(f"Karten nicht nach ID sortiert: {card_id} nach {last_id}")
+        last_id = card_id
+        values = dict(card, id=card_id)
+        string_parts = []
+        for field in STRING_FIELDS:
+            string_parts += add_string(values.get(field))
+
+        tag_parts = []
+        for field in TAG_FIELDS:
+            field_tags = card.get(field) or []
+            tag_parts += [len(tag_ids), len(field_tags)]
+            tag_ids.extend(tags(tag) for tag in field_tags)
+        for tag in set(card.get("tags") or []):
+            positions["tags"].setdefault(tag, []).append(i)
+
+        flags = 0
+        color_codes = 0
+        card_colors = card.get("colors")
+        if card_colors is None:
+            flags |= FLAG_COLORS_NONE
+        elif len(card_colors) > MAX_CARD_COLORS:
+            raise ValueError(f"Zu viele Farben bei {card_id}")
+        for n, color in enumerate(card_colors or []):
+            color_codes |= (colors(color) + 1) << (4 * n)
+        for color in set(card_colors or []):
+            positions["colors"].setdefault(color, []).append(i)
+
+        legal_bits = 0
+        if card.get("legalities") is None:
+            flags |= FLAG_LEGALITIES_NONE
+        for fmt, status in (card.get("legalities") or {}).items():
+            legal_bits |= (statuses(status) + 1) << (4 * formats(fmt))
+            if status == "legal":
+                positions["legal"].setdefault(fmt, []).append(i)
+
+        for token in set(type_tokens(card.get("type_line"))):
+            positions["type"].setdefault(token, []).append(i)
+
+        records += RECORD.pack(*string_parts, *tag_parts, legal_bits & 0xFFFFFFFFFFFFFFFF, legal_bits >> 64, color_codes, flags)
+        count += 1
+
+    tag_vocab = bytearray()
+    for tag in tags.values:
+        tag_vocab += struct.pack("<II", *add_string(tag))
+
+    postings_blob = bytearray()
+    postings = {}
+    for kind, keys in positions.items():
+        postings[kind] = {}
+        for key, key_positions in keys.items():
+            data = bits_from_positions(key_positions).to_bytes((key_positions[-1] >> 3) + 1, "little")
+            postings[kind][key] = [len(postings_blob), len(data)]
+            postings_blob += data
+
+    sections = {}
+    body = bytearray()
+    for name, data in [("records", records), ("tag_ids", struct.pack(f"<{len(tag_ids)}I", *tag_ids)),
+                       ("tag_vocab", tag_vocab), ("strings", strings), ("postings", postings_blob)]:
+        # 8-byte alignment so the integer sections can be cast from the mmap directly
+        body += bytes(-(HEADER.size + len(body)) % 8)
+        sections[name] = [HEADER.size + len(body), len(data)]
+        body += data
+    directory = json.dumps({
+        "count": count,
+        "sections": sections,
+        "colors": colors.values,
+        "formats": formats.values,
+        "statuses": statuses.values,
+        "postings": postings
+    }).encode("utf-8")
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, HEADER.size + len(body), len(directory)))
+        f.write(body)
+        f.write(directory)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+# build step: card_tags_merged.json -> card_tags_merged.bin. Cards are streamed from the
+# result store behind the JSON if there is one, otherwise the JSON file is loaded.
+def build_card_store(json_path="resources/card_tags_merged.json", out_path=None):
+    out_path = out_path or card_store_path_for(json_path)
+    if os.path.exists(store_path_for(json_path)):
+        with ResultStore(json_path) as store:
+            write_card_store(store.items(), out_path, presorted=True)
+            count = len(store)
+    else:
+        with open(json_path, "r", encoding="utf-8") as f:
+            cards = json.load(f)
+        write_card_store(cards.items(), out_path)
+        count = len(cards)
+    print(f"🗄️  Kartenspeicher geschrieben: {out_path} ({count} Karten)")
+    return out_path
+
+
+# Read-only view on a card store. The file is memory-mapped, so processes opening the
+# same file share the page cache; cards are decoded only when accessed.
+class CardStore:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, dir_offset, dir_length = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} ist kein Kartenspeicher")
+        directory = json.loads(self._mm[dir_offset:dir_offset + dir_length])
+        self._count = directory["count"]
+        self._colors = directory["colors"]
+        self._formats = directory["formats"]
+        self._statuses = directory["statuses"]
+        self._posting_dir = directory["postings"]
+        self._view = view = memoryview(self._mm)
+        sections = {name: view[offset:offset + length] for name, (offset, length) in directory["sections"].items()}
+        self._records = sections["records"]
+        self._tag_ids = sections["tag_ids"].cast("I")
+        self._tag_vocab = sections["tag_vocab"].cast("I")
+        self._strings = sections["strings"]
+        self._postings = sections["postings"]
+        self._tag_cache = {}
+
+    def __len__(self):
+        return self._count
+
+    def _string(self, offset, length):
+        if length == NONE_LENGTH:
+            return None
+        return str(self._strings[offset:offset + length], "utf-8")
+
+    def _record(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return RECORD.unpack_from(self._records, i * RECORD.size)
+
+    def _tag(self, tag_id):
+        tag = self._tag_cache.get(tag_id)
+        if tag is None:
+            tag = self._tag_cache[tag_id] = self._string(self._tag_vocab[2 * tag_id], self._tag_vocab[2 * tag_id + 1])
+        return tag
+
+    def card_id(self, i):
+        record = self._record(i)
+        return self._string(record[0], record[1])
+
+    def type_line(self, i):
+        record = self._record(i)
+        return self._string(record[4], record[5])
+
+    # decodes the i-th card (in id order) into the same dict shape as card_tags_merged.json
+    def __getitem__(self, i):
+        record = self._record(i)
+        card = {}
+        for n, field in enumerate(STRING_FIELDS[1:], start=1):
+            card[field] = self._string(record[2 * n], record[2 * n + 1])
+        flags = record[-1]
+        card["colors"] = None if flags & FLAG_COLORS_NONE else [
+            self._colors[code - 1]
+            for n in range(MAX_CARD_COLORS)
+            for code in [record[-2] >> (4 * n) & 0xF] if code
+        ]
+        legal_bits = record[-4] | record[-3] << 64
+        card["legalities"] = None if flags & FLAG_LEGALITIES_NONE else {
+            fmt: self._statuses[code - 1]
+            for n, fmt in enumerate(self._formats)
+            for code in [legal_bits >> (4 * n) & 0xF] if code
+        }
+        for n, field in enumerate(TAG_FIELDS):
+            offset, count = record[12 + 2 * n], record[13 + 2 * n]
+            card[field] = [self._tag(tag_id) for tag_id in self._tag_ids[offset:offset + count]]
+        return card
+
+    # binary search over the id-sorted records
+    def find(self, card_id):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.card_id(mid) < card_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self.card_id(lo) == card_id:
+            return lo
+        return None
+
+    def get(self, card_id, default=None):
+        i = self.find(card_id)
+        return default if i is None else self[i]
+
+    def items(self):
+        for i in range(self._count):
+            yield self.card_id(i), self[i]
+
+    def tag_vocabulary(self):
+        return [self._tag(tag_id) for tag_id in range(len(self._tag_vocab) // 2)]
+
+    # posting bitmaps of one kind ("tags", "colors", "legal", "type"), decoded on first access
+    def postings(self, kind):
+        return _LazyPostings(self._postings, self._posting_dir.get(kind, {}))
+
+    def close(self):
+        for view in (self._records, self._tag_ids, self._tag_vocab, self._strings, self._postings, self._view):
+            view.release()
+        self._mm.close()
+
+
+class _LazyPostings:
+    def __init__(self, blob, directory):
+        self._blob = blob
+        self._directory = directory
+        self._decoded = {}
+
+    def get(self, key, default=None):
+        bits = self._decoded.get(key)
+        if bits is None:
+            entry = self._directory.get(key)
+            if entry is None:
+                return default
+            bits = self._decoded[key] = int.from_bytes(self._blob[entry[0]:entry[0] + entry[1]], "little")
+        return bits
+
+    def __contains__(self, key):
+        return key in self._directory
+
+    def __len__(self):
+        return len(self._directory)
+
+    def __iter__(self):
+        return iter(self._directory)
+
+    def items(self):
+        for key in self._directory:
+            yield key, self.get(key)
+
+
+# sequence adapter so CardIndex can address columns of the store by position
+class StoreColumn:
+    def __init__(self, store, getter):
+        self._store = store
+        self._getter = getter
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, i):
+        return self._getter(i)
+
+
+# search index backed by the store: posting lists come precomputed from the file
+def open_card_index(store):
+    return CardIndex(
+        StoreColumn(store, store.card_id),
+        store,
+        StoreColumn(store, lambda i: (store.type_line(i) or "").lower()),
+        store.postings("tags"),
+        store.postings("colors"),
+        store.postings("legal"),
+        store.postings("type")
+    )
@@ -1,36 +1,165 @@
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-import json
 
+from scryfall_bulk import iter_bulk_cards
 
-def download_card_images(bulk_json_path, output_dir, limit=100):
-    os.makedirs(output_dir, exist_ok=True)
-    with open(bulk_json_path, 'r', encoding='utf-8') as f:
-        cards = json.load(f)
+# Scryfall asks for 50-100 ms between requests, i.e. at most ~10 requests per second
+DEFAULT_RATE = 10.0
+USER_AGENT = "MagicCardTagger/1.0"
+META_FILE = ".download_meta.json"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+# token bucket shared by all download threads
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+# one keep-alive connection pool shared by all threads
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT, "Accept": "image/*,*/*;q=0.8"})
+    return session
 
-    existing_ids = {filename.replace(".jpg", "") for filename in os.listdir(output_dir) if filename.endswith(".jpg")}
-    count = 0
 
-    for card in tqdm(cards):
-        card_id = card['id']
-        if card_id in existing_ids:
-            continue
+def _load_meta(output_dir):
+    path = os.path.join(output_dir, META_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
 
-        if 'image_uris' in card and card['image_uris'].get('normal'):
-            img_url = card['image_uris']['normal']
-            img_name = f"{card_id}.jpg"
-            img_path = os.path.join(output_dir, img_name)
 
-            try:
-                img_data = requests.get(img_url).content
-                with open(img_path, 'wb') as f:
-                    f.write(img_data)
-            except Exception as e:
-                print(f"Fehler bei {card['name']}: {e}")
+def _save_meta(output_dir, meta):
+    path = os.path.join(output_dir, META_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+# downloads one image with retries; returns "downloaded", "unchanged" or raises after the last attempt
+def fetch_image(session, limiter, url, img_path, cached=None, retries=4, backoff=0.5, timeout=30):
+    headers = {}
+    if cached and os.path.exists(img_path):
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    return "unchanged", cached
+                if response.status_code in RETRY_STATUS and attempt < retries:
+                    retry_after = response.headers.get("Retry-After", "")
+                    delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+                    time.sleep(delay)
+                    continue
+                response.raise_for_status()
+
+                tmp_path = f"{img_path}.{threading.get_ident()}.part"
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=64 * 1024):
+                            f.write(chunk)
+                    os.replace(tmp_path, img_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                return "downloaded", {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                }
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def download_card_images(bulk_json_path, output_dir, limit=100, concurrency=8, rate=DEFAULT_RATE, refresh=False, session=None):
+    os.makedirs(output_dir, exist_ok=True)
+    existing_ids = {filename.replace(".jpg", "") for filename in os.listdir(output_dir) if filename.endswith(".jpg")}
+    meta = _load_meta(output_dir)
+    session = session or make_session(concurrency)
+    limiter = RateLimiter(rate, burst=concurrency)
+
+    def candidates():
+        for card in iter_bulk_cards(bulk_json_path, fields=("id", "name", "image_uris")):
+            url = (card.get('image_uris') or {}).get('normal')
+            if not url:
+                continue
+            if card['id'] in existing_ids and not (refresh and card['id'] in meta):
+                continue
+            yield card, url
+
+    count = 0
+    unchanged = 0
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor, tqdm(desc="📥 Download") as progress:
+            pending = {}
+            queue = candidates()
+            exhausted = False
+            while True:
+                # failed downloads free their slot, so limit counts successful downloads only
+                while not exhausted and len(pending) < concurrency * 2 and count + len(pending) < limit:
+                    try:
+                        card, url = next(queue)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    img_path = os.path.join(output_dir, f"{card['id']}.jpg")
+                    future = executor.submit(fetch_image, session, limiter, url, img_path, meta.get(card['id']))
+                    pending[future] = card
+                if not pending:
+                    break
 
-            count += 1
-            if count >= limit:
-                break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    card = pending.pop(future)
+                    try:
+                        status, info = future.result()
+                        meta[card['id']] = info
+                        if status == "downloaded":
+                            count += 1
+                            progress.update(1)
+                        else:
+                            unchanged += 1
+                    except Exception as e:
+                        failed += 1
+                        print(f"Fehler bei {card['name']}: {e}")
+    finally:
+        _save_meta(output_dir, meta)
 
-    print(f"📥 {count} neue Bilder heruntergeladen.")
+    print(f"📥 {count} neue Bilder heruntergeladen ({unchanged} unverändert, {failed} Fehler).")
@@ -0,0 +1,143 @@
+import json
+import os
+
+import numpy as np
+
+from search_index import iter_bits
+
+EMBEDDINGS_FILE = "resources/card_embeddings.npy"
+# rows scored per step; float16 rows are converted to float32 block by block
+BLOCK_ROWS = 16384
+
+
+# resources/card_embeddings.npy -> resources/card_embeddings.json (card ids per row, model key)
+def embeddings_meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _store_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+# card store positions of the rows, so loading the index needs no id lookups while the
+# card store is the one the embeddings were built against
+def _store_positions(store_path, ids):
+    from card_store import CardStore
+    if not os.path.exists(store_path):
+        return None
+    store = CardStore(store_path)
+    try:
+        positions = [store.find(card_id) for card_id in ids]
+        return {"signature": _store_signature(store_path), "positions": [-1 if p is None else p for p in positions]}
+    finally:
+        store.close()
+
+
+# build step: L2-normalized CLIP image embedding per card of the result store, as a float16
+# matrix (one row per card, ids in the sidecar). Embeddings come from the inference cache,
+# cards without a cached embedding are left out.
+def build_card_embeddings(merged_path="resources/card_tags_merged.json", img_dir="images", out_path=EMBEDDINGS_FILE):
+    from auto_captioning import clip_cache_key
+    from card_store import card_store_path_for
+    from inference_cache import InferenceCache
+    from result_store import ResultStore
+    import model_registry
+
+    model = clip_cache_key()
+    ids, rows = [], []
+    with ResultStore(merged_path) as store, InferenceCache() as cache:
+        for batch in store.batches(1000):
+            hashes = {}
+            for card_id, _ in batch:
+                path = os.path.join(img_dir, f"{card_id}.jpg")
+                if os.path.exists(path):
+                    hashes[card_id] = cache.file_hash(path)
+            embeddings = cache.get_embeddings(hashes.values(), model)
+            for card_id, _ in batch:
+                embedding = embeddings.get(hashes.get(card_id))
+                if embedding is not None:
+                    ids.append(card_id)
+                    rows.append(embedding.numpy())
+
+    matrix = np.array(rows, dtype=np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = (matrix / np.where(norms == 0, 1, norms)).astype(np.float16)
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = out_path + ".tmp.npy"
+    np.save(tmp_path, matrix)
+    meta_path = embeddings_meta_path(out_path)
+    with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"model": model, "backend": model_registry.get_backend(), "dim": matrix.shape[1], "ids": ids,
+                   "card_store": _store_positions(card_store_path_for(merged_path), ids)}, f)
+    os.replace(tmp_path, out_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    print(f"🧭 {len(ids)} Bild-Embeddings geschrieben: {out_path}")
+    return out_path
+
+
+# Brute-force cosine top-k over the card embeddings. The matrix is memory-mapped; rows are
+# mapped to positions of a CardIndex so results can be restricted by its filter bitmaps.
+# Rows of cards missing from the card data are never returned.
+class EmbeddingIndex:
+    def __init__(self, path, card_index, card_store_path=None):
+        with open(embeddings_meta_path(path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.path = path
+        self.model = meta["model"]
+        self.backend = meta.get("backend", "fp32")
+        self.ids = meta["ids"]
+        self.matrix = np.load(path, mmap_mode="r")
+        self.rows = {card_id: row for row, card_id in enumerate(self.ids)}
+        stored = meta.get("card_store")
+        if (stored and card_store_path and os.path.exists(card_store_path)
+                and stored["signature"] == _store_signature(card_store_path)):
+            self.row_positions = np.array(stored["positions"], dtype=np.int64).reshape(len(self.ids))
+        else:
+            # card data changed since the build: look the ids up instead
+            self.row_positions = np.array([
+                -1 if position is None else position
+                for position in map(card_index.position, self.ids)
+            ], dtype=np.int64).reshape(len(self.ids))
+        self.mapped_rows = np.flatnonzero(self.row_positions >= 0)
+        self.position_rows = np.full(len(card_index), -1, dtype=np.int64)
+        self.position_rows[self.row_positions[self.mapped_rows]] = self.mapped_rows
+
+    def __len__(self):
+        return len(self.ids)
+
+    # embedding of a card of the current card data, else None
+    def vector(self, card_id):
+        row = self.rows.get(card_id)
+        if row is None or self.row_positions[row] < 0:
+            return None
+        return self.matrix[row].astype(np.float32)
+
+    # rows of the cards in a filter bitmap (None = all cards)
+    def candidate_rows(self, bits=None):
+        if bits is None:
+            return None
+        positions = np.fromiter(iter_bits(bits), dtype=np.int64)
+        rows = self.position_rows[positions] if len(positions) else positions
+        return rows[rows >= 0]
+
+    # [(index position, score)] of the k rows most similar to query, best first
+    def top_k(self, query, k=20, rows=None, exclude_row=None):
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        if rows is None:
+            scores = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), BLOCK_ROWS):
+                scores[start:start + BLOCK_ROWS] = self.matrix[start:start + BLOCK_ROWS].astype(np.float32) @ query
+            rows = self.mapped_rows
+            scores = scores[rows]
+        else:
+            rows = np.sort(rows)
+            scores = self.matrix[rows].astype(np.float32) @ query if len(rows) else np.empty(0, dtype=np.float32)
+        if exclude_row is not None:
+            keep = rows != exclude_row
+            rows, scores = rows[keep], scores[keep]
+        best = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(self.row_positions[rows[i]]), float(scores[i])) for i in best]
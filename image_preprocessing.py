@@ -0,0 +1,69 @@
+import time
+
+from PIL import Image
+import torch
+# registers shared-memory reductions, so tensors returned from worker processes are not copied through pipes
+import torch.multiprocessing  # noqa: F401
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+BLIP_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+
+_processors = None
+
+
+# processors only (no model weights), cheap enough to load once per worker process
+def get_processors():
+    global _processors
+    if _processors is None:
+        from transformers import CLIPProcessor, BlipProcessor
+        _processors = (
+            CLIPProcessor.from_pretrained(CLIP_MODEL_NAME),
+            BlipProcessor.from_pretrained(BLIP_MODEL_NAME),
+        )
+    return _processors
+
+
+def init_worker():
+    torch.set_num_threads(1)
+    get_processors()
+
+
+def _target_size(processor):
+    size = processor.image_processor.size
+    edge = size.get("shortest_edge") or max(size.get("height", 0), size.get("width", 0))
+    return edge, edge
+
+
+# decode a card image; JPEGs are decoded at reduced scale if the processors don't need full resolution
+def load_image(path):
+    clip_processor, blip_processor = get_processors()
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            target = max(_target_size(clip_processor), _target_size(blip_processor))
+            img.draft("RGB", target)
+        return img.convert("RGB")
+
+
+# decode once and run the resize/normalization of the requested processors ("clip", "blip");
+# seconds per step are added to timings if given
+def preprocess_image(path, models=("clip", "blip"), timings=None):
+    processors = dict(zip(("clip", "blip"), get_processors()))
+    start = time.perf_counter()
+    image = load_image(path)
+    steps = {"decode": time.perf_counter() - start}
+    pixels = {}
+    for name in models:
+        start = time.perf_counter()
+        pixels[name] = processors[name](images=image, return_tensors="pt")["pixel_values"][0]
+        steps[f"{name}_preprocess"] = time.perf_counter() - start
+    if timings is not None:
+        timings.update(steps)
+    return pixels
+
+
+# pipeline entry point for (card_id, path) items
+def preprocess_item(item):
+    timings = {}
+    loaded = preprocess_image(item[1], timings=timings)
+    loaded["timings"] = timings
+    return loaded
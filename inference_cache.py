@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+import torch
+
+from image_preprocessing import preprocess_image
+
+CACHE_PATH = "resources/cache/inference.sqlite"
+
+# read-only connection per worker process, opened on first use
+_worker_cache = None
+
+
+# content hash of an image file; reprints with identical art share it
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Model outputs per image, keyed by content hash and model key (model id plus generation
+# parameters for captions). CLIP image embeddings are stored as float16.
+class InferenceCache:
+    def __init__(self, path=CACHE_PATH, readonly=False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=60)
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # nodes of a queue run may share the cache; writers wait for each other instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash TEXT, model TEXT, vector BLOB NOT NULL, PRIMARY KEY (hash, model))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS captions (hash TEXT, model TEXT, caption TEXT NOT NULL, PRIMARY KEY (hash, model))")
+        # content hash per image file, valid as long as size and mtime are unchanged
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT NOT NULL)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup(self, table, column, hashes, model):
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        # stay below SQLite's host parameter limit
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT hash, {column} FROM {table} WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                [model, *chunk]
+            )
+            found.update(rows)
+        return found
+
+    # hash -> float32 tensor for all cached hashes
+    def get_embeddings(self, hashes, model):
+        return {
+            digest: torch.from_numpy(np.frombuffer(vector, dtype=np.float16).astype(np.float32))
+            for digest, vector in self._lookup("embeddings", "vector", hashes, model).items()
+        }
+
+    def put_embeddings(self, items, model):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, model, vector) VALUES (?, ?, ?)",
+                ((digest, model, vector.detach().cpu().to(torch.float16).numpy().tobytes()) for digest, vector in items)
+            )
+
+    def get_captions(self, hashes, model):
+        return self._lookup("captions", "caption", hashes, model)
+
+    def put_captions(self, items, model):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO captions (hash, model, caption) VALUES (?, ?, ?)",
+                ((digest, model, caption) for digest, caption in items)
+            )
+
+    # records hashes computed elsewhere (e.g. by the preprocessing workers) for (path, hash) pairs
+    def remember_file_hashes(self, items):
+        rows = []
+        for path, digest in items:
+            st = os.stat(path)
+            rows.append((os.path.abspath(path), st.st_size, st.st_mtime_ns, digest))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)", rows)
+
+    # content hash of an image file, read from the file only if it changed since it was last hashed
+    def file_hash(self, path):
+        st = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = file_hash(path)
+        self.remember_file_hashes([(path, digest)])
+        return digest
+
+    def close(self):
+        self.conn.close()
+
+
+def _get_worker_cache(cache_path):
+    global _worker_cache
+    if _worker_cache is None and os.path.exists(cache_path):
+        _worker_cache = InferenceCache(cache_path, readonly=True)
+    return _worker_cache
+
+
+# pipeline entry point for (card_id, path) items: hashes the file and decodes it only for the
+# models whose output is not cached yet. Cached outputs are returned as clip_embedding/caption.
+def preprocess_item_cached(item, cache_path, clip_key, blip_key):
+    start = time.perf_counter()
+    digest = file_hash(item[1])
+    timings = {"hash": time.perf_counter() - start}
+    start = time.perf_counter()
+    cache = _get_worker_cache(cache_path)
+    embedding = caption = None
+    if cache is not None:
+        embedding = cache.get_embeddings([digest], clip_key).get(digest)
+        caption = cache.get_captions([digest], blip_key).get(digest)
+    timings["worker_cache_lookup"] = time.perf_counter() - start
+    need = [name for name, value in (("clip", embedding), ("blip", caption)) if value is None]
+    loaded = preprocess_image(item[1], need, timings) if need else {}
+    loaded.update(hash=digest, clip_embedding=embedding, caption=caption, timings=timings)
+    return loaded
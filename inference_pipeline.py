@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+
+_DONE = object()
+
+
+# queued by the producer when loading stops on an error (e.g. a worker process died);
+# the consumer re-raises it instead of treating it as the end of the input
+class _ProducerFailed:
+    def __init__(self, error):
+        self.error = error
+
+
+def _safe_load(load_fn, item):
+    try:
+        return item, load_fn(item), None
+    except Exception as e:
+        return item, None, e
+
+
+def _make_executor(executor, max_workers, initializer):
+    if executor == "process":
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer)
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=initializer)
+
+
+# producer: loads items on a worker pool and groups them into micro-batches on a bounded queue.
+# With executor="process", load_fn and items must be picklable.
+def iter_batches(items, load_fn, batch_size=8, max_workers=4, queue_size=4, executor="process", initializer=None):
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            with _make_executor(executor, max_workers, initializer) as pool:
+                pending = deque()
+                batch = []
+                window = max(batch_size * 2, max_workers * 2)
+                item_iter = iter(items)
+                exhausted = False
+                while not stop.is_set():
+                    while not exhausted and len(pending) < window:
+                        try:
+                            pending.append(pool.submit(_safe_load, load_fn, next(item_iter)))
+                        except StopIteration:
+                            exhausted = True
+                    if not pending:
+                        break
+                    metrics.gauge("pending_loads", len(pending))
+                    batch.append(pending.popleft().result())
+                    if len(batch) >= batch_size:
+                        batches.put(batch)
+                        batch = []
+                if batch and not stop.is_set():
+                    batches.put(batch)
+                for future in pending:
+                    future.cancel()
+        except Exception as e:
+            print(f"❌ Fehler beim Laden der Bilder: {e}")
+            metrics.failure("producer", e)
+            batches.put(_ProducerFailed(e))
+        finally:
+            batches.put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            metrics.gauge("batch_queue_depth", batches.qsize())
+            # time the consumer waits for preprocessing; high values mean the workers are the bottleneck
+            start = time.perf_counter()
+            batch = batches.get()
+            if batch is _DONE:
+                break
+            if isinstance(batch, _ProducerFailed):
+                raise RuntimeError("Vorverarbeitung abgebrochen, restliche Karten nicht verarbeitet") from batch.error
+            metrics.observe("wait_for_batch", time.perf_counter() - start, len(batch))
+            yield batch
+    finally:
+        stop.set()
+        # drain so a blocked producer can finish
+        while producer.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+# consumer: runs infer_fn on whole batches and streams (item, result) back per item.
+# result is None if loading or inference failed for that item. Step timings the load
+# function returns under "timings" are recorded in the current metrics run.
+def run_batched(items, load_fn, infer_fn, batch_size=8, max_workers=4, queue_size=4, executor="process", initializer=None):
+    for batch in iter_batches(items, load_fn, batch_size, max_workers, queue_size, executor, initializer):
+        ready = []
+        for item, loaded, error in batch:
+            if error is not None:
+                print(f"❌ Fehler bei {item[0]}: {error}")
+                metrics.failure("load", error, item[0])
+                yield item, None
+            else:
+                if isinstance(loaded, dict):
+                    for stage, seconds in loaded.pop("timings", {}).items():
+                        metrics.observe(stage, seconds)
+                ready.append((item, loaded))
+        if not ready:
+            continue
+        try:
+            results = infer_fn(ready)
+        except Exception as e:
+            print(f"⚠️  Fehler im Batch ({len(ready)} Karten), verarbeite einzeln: {e}")
+            metrics.failure("infer_batch", e)
+            results = [_infer_single(infer_fn, entry) for entry in ready]
+        for (item, _), result in zip(ready, results):
+            yield item, result
+
+
+def _infer_single(infer_fn, entry):
+    try:
+        return infer_fn([entry])[0]
+    except Exception as e:
+        print(f"❌ Fehler bei {entry[0][0]}: {e}")
+        metrics.failure("infer", e, entry[0][0])
+        return None
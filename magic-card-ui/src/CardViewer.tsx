@@ -9,18 +9,47 @@ const COLOR_MAP = {
     colorless: ["c", "colorless"]
 };
 
+const RESOURCES = "/resources/cards";
+// tag facets shown as shortcuts above the grid
+const TOP_TAGS = 24;
+
 export default function CardViewer() {
     const [cards, setCards] = useState([]);
+    const [facets, setFacets] = useState({ total: 0, tags: {}, colors: {} });
     const [hoveredCard, setHoveredCard] = useState(null);
     const [mousePos, setMousePos] = useState({ x: 0, y: 0 });
     const [search, setSearch] = useState("");
 
+    // manifest.json is revalidated on every load; shards and facets have content-hashed names
+    // and can be cached indefinitely. Shards are shown as soon as each one arrives.
     useEffect(() => {
-        fetch("/resources/card_tags_merged.json")
+        let cancelled = false;
+        fetch(`${RESOURCES}/manifest.json`, { cache: "no-cache" })
             .then(res => res.json())
-            .then(data => setCards(Object.values(data)));
+            .then(manifest => {
+                fetch(`${RESOURCES}/${manifest.facets}`)
+                    .then(res => res.json())
+                    .then(data => !cancelled && setFacets(data));
+                const loaded = new Array(manifest.shards.length);
+                manifest.shards.forEach((shard: { file: string }, i: number) => {
+                    fetch(`${RESOURCES}/${shard.file}`)
+                        .then(res => res.json())
+                        .then(data => {
+                            loaded[i] = data;
+                            if (!cancelled) setCards(loaded.filter(Boolean).flat());
+                        });
+                });
+            });
+        return () => {
+            cancelled = true;
+        };
     }, []);
 
+    const addSearchTerm = (term: string) => {
+        const terms = search.split(" ").filter(Boolean);
+        if (!terms.includes(term)) setSearch([...terms, term].join(" "));
+    };
+
     const matchesColor = (colors: string | string[], searchTerm: string) => {
         if (!colors || !searchTerm) return false;
         const lower = searchTerm.toLowerCase();
@@ -75,6 +104,19 @@ export default function CardViewer() {
                     onChange={e => setSearch(e.target.value)}
                     className="w-full px-4 py-2 rounded-lg border border-indigo-500 bg-gray-700 text-white placeholder:text-indigo-300 shadow-inner focus:outline-none focus:ring-2 focus:ring-indigo-400 transition-all duration-200"
                 />
+                <span className="text-xs text-gray-400 whitespace-nowrap">{filtered.length} / {facets.total || cards.length}</span>
+            </div>
+
+            <div className="mb-4 flex flex-wrap gap-1">
+                {Object.entries(facets.tags).slice(0, TOP_TAGS).map(([tag, count]) => (
+                    <button
+                        key={tag}
+                        onClick={() => addSearchTerm(tag)}
+                        className="text-[10px] bg-gray-700 text-indigo-100 px-2 py-[2px] rounded hover:bg-indigo-700"
+                    >
+                        {tag} <span className="text-gray-400">{count as number}</span>
+                    </button>
+                ))}
             </div>
 
             <div className="relative grid grid-cols-2 sm:grid-cols-3 md:grid-cols-4 lg:grid-cols-6 gap-4">
@@ -1,9 +1,8 @@
 import argparse
-from auto_tagging import tag_all_images, tag_all_parallel
-from downloader import download_card_images
-from nlp_processing import update_tags_from_text_and_captions
-from ui_exporter import export_json_for_frontend
 
+import model_registry
+
+# the pipeline modules are imported per stage, so e.g. the download does not load torch/transformers/spaCy
 
 # 1. Bilder herunterladen
 # download_card_images("default-cards.json", "images", limit=100)
@@ -21,14 +20,47 @@ if __name__ == "__main__":
     parser.add_argument("--images", type=str, default="images", help="Pfad zum Bildordner")
     parser.add_argument("--bulk", type=str, default="resources/scryfall-default-cards.json", help="Pfad zur Scryfall JSON")
     parser.add_argument("--output", type=str, default="resources/card_tags_merged.json", help="Ausgabepfad der Tag-Datenbank")
-    parser.add_argument("--workers", type=int, default=None, help="Anzahl der parallelen Threads")
+    parser.add_argument("--workers", type=int, default=None, help="Vorverarbeitungs-Prozesse (Standard: ein Viertel der Kerne, höchstens 4); die übrigen Kerne, mindestens die Hälfte, gehen an die Inferenz")
+    parser.add_argument("--batch-size", type=int, default=8, help="Anzahl Bilder pro Inferenz-Batch")
+    parser.add_argument("--nlp-processes", type=int, default=1, help="Anzahl Prozesse für die Text-Tags (spaCy nlp.pipe)")
+    parser.add_argument("--backend", choices=model_registry.BACKENDS, default=None, help="Inferenz-Backend (int8 = dynamisch quantisiert, nur CPU)")
+    parser.add_argument("--threads", type=int, default=None, help="Inferenz-Threads (Standard: Kerne minus Vorverarbeitungs-Prozesse, mindestens die Hälfte der Kerne)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Port für Prometheus-Metriken (/metrics) während des Taggings")
+    parser.add_argument("--shards", type=int, default=1, help="Anzahl Shards für verteilte Läufe (Aufteilung nach Karten-ID-Hash)")
+    parser.add_argument("--shard", type=int, default=None, help="Shard dieses Knotens (0 bis --shards - 1)")
+    parser.add_argument("--queue", type=str, default=None, help="Gemeinsame Warteschlange (SQLite), aus der sich Knoten Karten holen")
+    parser.add_argument("--node", type=str, default=None, help="Name dieses Knotens für --queue (Standard: Hostname-PID)")
+    parser.add_argument("--merge", action="store_true", help="Teilergebnisse der Knoten zusammenführen und die Folgeschritte ausführen")
     parser.add_argument("--download", action="store_true", help="Bilder herunterladen")
     parser.add_argument("--limit", type=int, default=100, help="Maximale Anzahl neuer Bilder")
+    parser.add_argument("--concurrency", type=int, default=8, help="Anzahl paralleler Downloads")
+    parser.add_argument("--refresh-images", action="store_true", help="Vorhandene Bilder per ETag/If-Modified-Since auf Änderungen prüfen")
     args = parser.parse_args()
 
+    if args.backend:
+        model_registry.set_backend(args.backend)
+
     if args.download:
-        download_card_images(args.bulk, args.images, limit=args.limit)
+        from downloader import download_card_images
+        download_card_images(args.bulk, args.images, limit=args.limit, concurrency=args.concurrency, refresh=args.refresh_images)
+
+    from auto_tagging import tag_all_parallel
+    from card_store import build_card_store
+    from embedding_index import build_card_embeddings
+    from nlp_processing import update_tags_from_text_and_captions
+    from ui_exporter import export_json_for_frontend
 
-    tag_all_parallel(args.images, args.bulk, args.output, max_workers=args.workers)
+    if args.merge:
+        from sharding import merge_partial_results
+        merge_partial_results(args.output)
+    else:
+        tag_all_parallel(args.images, args.bulk, args.output, max_workers=args.workers, batch_size=args.batch_size, nlp_processes=args.nlp_processes, threads=args.threads, metrics_port=args.metrics_port,
+                         shard=args.shard, shards=args.shards, queue_path=args.queue, node=args.node)
+        if args.queue or args.shards > 1:
+            # the remaining steps need the results of all nodes
+            print("ℹ️  Teilergebnis geschrieben. Nach dem Lauf aller Knoten: python main.py --merge")
+            raise SystemExit(0)
     update_tags_from_text_and_captions(args.output)
-    export_json_for_frontend()
\ No newline at end of file
+    build_card_store(args.output)
+    build_card_embeddings(args.output, args.images)
+    export_json_for_frontend(args.output)
\ No newline at end of file
@@ -0,0 +1,220 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPORT_DIR = "resources/reports"
+# per-stage samples kept for percentiles; totals and counts are always exact
+MAX_SAMPLES = 10000
+# kept error messages per failure type
+MAX_EXAMPLES = 5
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# ru_maxrss is KiB on Linux and bytes on macOS
+def _maxrss_bytes(who):
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+# Metrics of one pipeline run: time per stage (per card), gauges such as queue depths,
+# counters and failures by exception type. Thread-safe; worker processes report their
+# timings with their results and the main process records them.
+class RunMetrics:
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.gauges = {}
+        self.counters = {}
+        self.failures = {}
+
+    # seconds spent on a stage for count cards (e.g. one forward pass over a batch)
+    def observe(self, stage, seconds, count=1):
+        with self._lock:
+            stats = self.stages.setdefault(stage, {"seconds": 0.0, "cards": 0, "calls": 0, "samples": []})
+            stats["seconds"] += seconds
+            stats["cards"] += count
+            stats["calls"] += 1
+            if count and len(stats["samples"]) < MAX_SAMPLES:
+                stats["samples"].append(seconds / count)
+
+    @contextmanager
+    def timer(self, stage, count=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, count)
+
+    def gauge(self, name, value):
+        with self._lock:
+            stats = self.gauges.setdefault(name, {"last": value, "max": value, "sum": 0, "samples": 0})
+            stats["last"] = value
+            stats["max"] = max(stats["max"], value)
+            stats["sum"] += value
+            stats["samples"] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def failure(self, stage, error, item=None):
+        key = f"{stage}:{type(error).__name__}"
+        with self._lock:
+            entry = self.failures.setdefault(key, {"count": 0, "examples": []})
+            entry["count"] += 1
+            if len(entry["examples"]) < MAX_EXAMPLES:
+                entry["examples"].append({"item": item, "error": str(error)})
+
+    def memory(self):
+        memory = {
+            "peak_rss_bytes": _maxrss_bytes(resource.RUSAGE_SELF),
+            # finished child processes only, i.e. the preprocessing workers after the pool closed
+            "peak_rss_children_bytes": _maxrss_bytes(resource.RUSAGE_CHILDREN),
+        }
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            memory["peak_cuda_bytes"] = torch.cuda.max_memory_allocated()
+        return memory
+
+    def report(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self._start
+            stages = {
+                stage: {
+                    "seconds": stats["seconds"],
+                    "cards": stats["cards"],
+                    "calls": stats["calls"],
+                    "share": stats["seconds"] / elapsed if elapsed else None,
+                    "per_card_mean": stats["seconds"] / stats["cards"] if stats["cards"] else None,
+                    "per_card_p50": _percentile(stats["samples"], 0.5),
+                    "per_card_p95": _percentile(stats["samples"], 0.95),
+                }
+                for stage, stats in self.stages.items()
+            }
+            gauges = {
+                name: {"last": stats["last"], "max": stats["max"], "mean": stats["sum"] / stats["samples"]}
+                for name, stats in self.gauges.items()
+            }
+            return {
+                "name": self.name,
+                "started": self.started,
+                "elapsed_seconds": elapsed,
+                "stages": stages,
+                "gauges": gauges,
+                "counters": dict(self.counters),
+                "failures": json.loads(json.dumps(self.failures)),
+                "memory": self.memory(),
+            }
+
+    def write_report(self, path=None):
+        if path is None:
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+            path = os.path.join(REPORT_DIR, f"{self.name}-{stamp}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+    def print_summary(self):
+        report = self.report()
+        print(f"\n⏱️  Laufzeit {report['elapsed_seconds']:.1f}s, Anteil je Stufe:")
+        for stage, stats in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            mean = stats["per_card_mean"]
+            print(f"- {stage}: {stats['seconds']:.2f}s ({stats['share'] or 0:.0%}), "
+                  f"{(mean or 0) * 1000:.1f} ms/Karte bei {stats['cards']} Karten")
+        for key, entry in report["failures"].items():
+            print(f"❌ {key}: {entry['count']}x")
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        report = self.report()
+        lines = [
+            "# TYPE tagger_stage_seconds_total counter",
+            *(f'tagger_stage_seconds_total{{stage="{stage}"}} {stats["seconds"]}' for stage, stats in report["stages"].items()),
+            "# TYPE tagger_stage_cards_total counter",
+            *(f'tagger_stage_cards_total{{stage="{stage}"}} {stats["cards"]}' for stage, stats in report["stages"].items()),
+            "# TYPE tagger_gauge gauge",
+            *(f'tagger_gauge{{name="{name}"}} {stats["last"]}' for name, stats in report["gauges"].items()),
+            "# TYPE tagger_events_total counter",
+            *(f'tagger_events_total{{name="{name}"}} {value}' for name, value in report["counters"].items()),
+            "# TYPE tagger_failures_total counter",
+        ]
+        for key, entry in report["failures"].items():
+            stage, error = key.split(":", 1)
+            lines.append(f'tagger_failures_total{{stage="{stage}",error="{error}"}} {entry["count"]}')
+        lines.append("# TYPE tagger_peak_memory_bytes gauge")
+        lines += [f'tagger_peak_memory_bytes{{kind="{kind}"}} {value}' for kind, value in report["memory"].items()]
+        lines.append(f"tagger_elapsed_seconds {report['elapsed_seconds']}")
+        return "\n".join(lines) + "\n"
+
+
+# the run all instrumented functions report to
+_current = RunMetrics()
+
+
+def start_run(name="pipeline"):
+    global _current
+    _current = RunMetrics(name)
+    return _current
+
+
+def current():
+    return _current
+
+
+def observe(stage, seconds, count=1):
+    _current.observe(stage, seconds, count)
+
+
+def timer(stage, count=1):
+    return _current.timer(stage, count)
+
+
+def gauge(name, value):
+    _current.gauge(name, value)
+
+
+def count(name, value=1):
+    _current.count(name, value)
+
+
+def failure(stage, error, item=None):
+    _current.failure(stage, error, item)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = current().prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# serves /metrics of the current run in a background thread
+def serve(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metriken unter http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+# Models are loaded on first use instead of at import time, so commands that don't need
+# them start without importing torch/transformers/spaCy. warmup() loads them up front.
+_loaders = {}
+_loaded = {}
+_lock = threading.RLock()
+_device = None
+
+# "fp32": HuggingFace models as loaded; "int8": Linear layers dynamically quantized (CPU only)
+BACKENDS = ("fp32", "int8")
+QUANTIZABLE = {"clip", "blip"}
+_backend = os.environ.get("MODEL_BACKEND", "fp32")
+
+
+def register(name, loader):
+    _loaders[name] = loader
+
+
+def set_backend(backend):
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unbekanntes Backend: {backend} (erlaubt: {', '.join(BACKENDS)})")
+    _backend = backend
+
+
+# dynamic quantization only runs on CPU, on a GPU the fp32 models are used
+def get_backend(backend=None):
+    backend = backend or _backend
+    if backend != "fp32" and get_device() != "cpu":
+        return "fp32"
+    return backend
+
+
+# model id for caches: outputs of a quantized model are not interchangeable with fp32 ones
+def model_key(model_name, backend=None):
+    backend = get_backend(backend)
+    return model_name if backend == "fp32" else f"{model_name}+{backend}"
+
+
+def _registry_key(name, backend):
+    if name not in QUANTIZABLE:
+        return name, None
+    backend = get_backend(backend)
+    return (name if backend == "fp32" else f"{name}@{backend}"), backend
+
+
+def get(name, backend=None):
+    key, backend = _registry_key(name, backend)
+    model = _loaded.get(key)
+    if model is None:
+        with _lock:
+            model = _loaded.get(key)
+            if model is None:
+                if name not in _loaders:
+                    raise KeyError(f"Unbekanntes Modell: {name}")
+                print(f"⏳ Lade {key} ...")
+                start = time.perf_counter()
+                model = _loaders[name]()
+                if backend == "int8":
+                    model = _quantize_int8(model)
+                _loaded[key] = model
+                print(f"✅ {key} geladen ({time.perf_counter() - start:.1f}s).")
+    return model
+
+
+def is_loaded(name, backend=None):
+    return _registry_key(name, backend)[0] in _loaded
+
+
+def warmup(*names):
+    for name in names:
+        get(name)
+
+
+# drops the reference so the memory can be freed once no caller holds the model anymore
+def unload(name, backend=None):
+    with _lock:
+        _loaded.pop(_registry_key(name, backend)[0], None)
+
+
+def _quantize_int8(model):
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+# preprocessing processes by default: decoding and resizing is cheap next to inference and the
+# workers mostly wait on the bounded batch queue, so a quarter of the cores (at most 4) suffice
+def default_workers():
+    return max(1, min(4, (os.cpu_count() or 1) // 4))
+
+
+# intra-op threads of the inference process: by default the cores the preprocessing workers
+# leave free, but never less than half of them; the workers are idle most of the time
+def configure_threads(workers=0, threads=None):
+    import torch
+    if threads is None:
+        cores = os.cpu_count() or 1
+        threads = max(1, cores - workers, cores // 2)
+    torch.set_num_threads(threads)
+    return threads
+
+
+def get_device():
+    global _device
+    if _device is None:
+        import torch
+        _device = "cuda" if torch.cuda.is_available() else "cpu"
+    return _device
+
+
+def _load_clip():
+    from transformers import CLIPModel
+    from image_preprocessing import CLIP_MODEL_NAME
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+    model.to(get_device())
+    model.eval()
+    return model
+
+
+def _load_blip():
+    from transformers import BlipForConditionalGeneration
+    from image_preprocessing import BLIP_MODEL_NAME
+    model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL_NAME)
+    model.to(get_device())
+    model.eval()
+    return model
+
+
+def _load_spacy():
+    import spacy
+    return spacy.load("en_core_web_sm")
+
+
+register("clip", _load_clip)
+register("blip", _load_blip)
+register("spacy", _load_spacy)
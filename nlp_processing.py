@@ -1,11 +1,35 @@
+import hashlib
 import os
 import json
-import spacy
+import numpy as np
 
+import model_registry
+from synonyms import SYNONYM_FILE, build_alias_index, normalize_card_tags
 from tag_provider import load_tags, save_tags
 
-nlp = spacy.load("en_core_web_sm")
-STOPWORDS = set(spacy.lang.en.stop_words.STOP_WORDS)
+_stopwords = None
+
+
+# the spaCy pipeline is loaded by the registry on first use
+def get_nlp():
+    return model_registry.get("spacy")
+
+
+def get_stopwords():
+    global _stopwords
+    if _stopwords is None:
+        from spacy.lang.en.stop_words import STOP_WORDS
+        _stopwords = set(STOP_WORDS)
+    return _stopwords
+
+
+# nlp and STOPWORDS are kept for existing imports, but resolved lazily
+def __getattr__(name):
+    if name == "nlp":
+        return get_nlp()
+    if name == "STOPWORDS":
+        return get_stopwords()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # update tags.json with new tags from text and captions
 def update_tags_from_text_and_captions(merged_path="resources/card_tags_merged.json", tag_path="resources/tags.json"):
@@ -33,7 +57,7 @@ def update_tags_from_text_and_captions(merged_path="resources/card_tags_merged.j
 
     print("🧠 baue Synonym-Mapping auf...")
     synonyms = build_synonym_map(tags)
-    with open("resources/tag_synonyms.json", "w", encoding="utf-8") as f:
+    with open(SYNONYM_FILE, "w", encoding="utf-8") as f:
         json.dump(synonyms, f, indent=2)
     print("🔁 Synonyme gespeichert in tag_synonyms.json")
 
@@ -42,58 +66,198 @@ def update_tags_from_text_and_captions(merged_path="resources/card_tags_merged.j
     save_tags(normalized_tags, tag_path)
     print("✨ Normalisierte Tags gespeichert.")
 
+    normalize_card_tags(merged_path)
+
 # normalize the tags based on the synonym map
 def normalize_tags_with_synonyms(tags, synonym_map):
-    normalized = set()
-    for tag in tags:
-        found = False
-        for main_tag, synonyms in synonym_map.items():
-            if tag == main_tag or tag in synonyms:
-                normalized.add(main_tag)
-                found = True
-                break
-        if not found:
-            normalized.add(tag)
-    return list(sorted(normalized))
+    alias_index = build_alias_index(synonym_map)
+    return sorted({alias_index.get(tag, tag) for tag in tags})
 
-# extract keywords from flavor text
-def extract_keywords_from_flavor(flavor_text):
-    doc = nlp(flavor_text)
+# noun_chunks only needs POS tags and the dependency parse
+NOUN_CHUNK_DISABLE = ("ner", "lemmatizer")
+# flavor text hash -> keywords; reprints share flavor text, so each text is parsed once
+_flavor_cache = {}
+
+
+def _disabled_components():
+    return [name for name in NOUN_CHUNK_DISABLE if name in get_nlp().pipe_names]
+
+
+def _text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _keywords_from_doc(doc):
+    stopwords = get_stopwords()
     keywords = set()
     for chunk in doc.noun_chunks:
         text = chunk.text.strip().lower()
-        if len(text) > 1 and text not in STOPWORDS:
+        if len(text) > 1 and text not in stopwords:
             keywords.add(text)
     return list(keywords)
 
-# extract tags from text fields
-def extract_tags_from_text_fields(card, known_tags=None):
+
+# extract keywords from flavor text
+def extract_keywords_from_flavor(flavor_text):
+    key = _text_key(flavor_text)
+    if key not in _flavor_cache:
+        _flavor_cache[key] = _keywords_from_doc(get_nlp()(flavor_text, disable=_disabled_components()))
+    return _flavor_cache[key]
+
+
+def _type_line_words(card):
+    stopwords = get_stopwords()
     words = set()
-    type_line = card.get("type_line", "").lower().replace("—", " ").replace("-", " ")
+    type_line = (card.get("type_line") or "").lower().replace("—", " ").replace("-", " ")
     for word in type_line.split():
-        if len(word) > 1 and word not in STOPWORDS:
+        if len(word) > 1 and word not in stopwords:
             words.add(word)
-    flavor = card.get("flavor_text", "").strip()
+    return words
+
+# extract tags from text fields
+def extract_tags_from_text_fields(card, known_tags=None):
+    words = _type_line_words(card)
+    flavor = (card.get("flavor_text") or "").strip()
     words.update(extract_keywords_from_flavor(flavor))
     return list(words)
 
-# build a synonym map based on similarity
-def build_synonym_map(tags, threshold=0.8):
-    seen = set()
-    synonym_groups = []
-    vectors = {tag: nlp(tag) for tag in tags if nlp(tag).has_vector}
-    for tag, doc in vectors.items():
-        if tag in seen:
-            continue
-        group = set()
-        for other_tag, other_doc in vectors.items():
-            if other_tag in seen or tag == other_tag:
-                continue
-            if doc.similarity(other_doc) > threshold:
-                group.add(other_tag)
-        if group:
-            group.add(tag)
-            seen.update(group)
-            synonym_groups.append(sorted(group))
+
+# bulk variant of extract_tags_from_text_fields for (card_id, card) pairs: all unseen flavor
+# texts of a chunk go through one nlp.pipe call; yields (card_id, text_tags) in input order
+def extract_text_tags_bulk(cards, batch_size=256, n_process=1, chunk_size=10000):
+    cards = iter(cards)
+    while True:
+        chunk = [entry for _, entry in zip(range(chunk_size), cards)]
+        if not chunk:
+            return
+        flavors = [(card.get("flavor_text") or "").strip() for _, card in chunk]
+        pending = {}
+        for flavor in flavors:
+            key = _text_key(flavor)
+            if key not in _flavor_cache:
+                pending[key] = flavor
+        if pending:
+            docs = get_nlp().pipe(pending.values(), batch_size=batch_size, n_process=n_process, disable=_disabled_components())
+            for key, doc in zip(pending, docs):
+                _flavor_cache[key] = _keywords_from_doc(doc)
+        for (card_id, card), flavor in zip(chunk, flavors):
+            words = _type_line_words(card)
+            words.update(_flavor_cache[_text_key(flavor)])
+            yield card_id, list(words)
+
+# tag vectors and above-threshold pairs of the last run, so only new tags need to be compared
+SYNONYM_VECTOR_CACHE = "resources/cache/tag_vectors.npz"
+
+
+def _model_id():
+    meta = get_nlp().meta
+    return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+
+
+def _load_vector_cache(cache_path, threshold):
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        cache = np.load(cache_path, allow_pickle=False)
+        if str(cache["model"]) != _model_id() or float(cache["threshold"]) != threshold:
+            return None
+        tags = [str(tag) for tag in cache["tags"]]
+        edges = {(tags[a], tags[b]) for a, b in cache["edges"]}
+        return tags, cache["vectors"], edges, {str(tag) for tag in cache["no_vector"]}
+    except Exception as e:
+        print(f"⚠️  Vektor-Cache unlesbar, wird neu erstellt: {e}")
+        return None
+
+
+def _save_vector_cache(cache_path, threshold, tags, vectors, edges, no_vector):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    positions = {tag: i for i, tag in enumerate(tags)}
+    edge_array = np.array([(positions[a], positions[b]) for a, b in edges], dtype=np.int32).reshape(-1, 2)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, model=_model_id(), threshold=threshold, tags=np.array(tags, dtype=str),
+             vectors=vectors, edges=edge_array, no_vector=np.array(sorted(no_vector), dtype=str))
+    os.replace(tmp_path, cache_path)
+
+
+# L2-normalized doc vectors for tags; tags without a vector are returned separately
+def _tag_vectors(tags):
+    with_vector, rows, no_vector = [], [], set()
+    for tag, doc in zip(tags, get_nlp().pipe(tags)):
+        norm = doc.vector_norm if doc.has_vector else 0
+        if norm:
+            with_vector.append(tag)
+            rows.append(doc.vector / norm)
+        else:
+            no_vector.add(tag)
+    dim = rows[0].shape[0] if rows else 0
+    return with_vector, np.array(rows, dtype=np.float32).reshape(len(rows), dim), no_vector
+
+
+# pairs (new_i, all_j) with cosine similarity above threshold, computed as blocked matrix products
+def _similar_pairs(new_vectors, all_vectors, offset, threshold, max_block_elements=1 << 24):
+    pairs = []
+    block = max(1, max_block_elements // max(1, len(all_vectors)))
+    for start in range(0, len(new_vectors), block):
+        sims = new_vectors[start:start + block] @ all_vectors.T
+        rows, cols = np.nonzero(sims > threshold)
+        for i, j in zip((rows + start + offset).tolist(), cols.tolist()):
+            # new-vs-old pairs once; new-vs-new pairs appear twice, keep j > i (drops self-pairs too)
+            if j < offset:
+                pairs.append((j, i))
+            elif j > i:
+                pairs.append((i, j))
+    return pairs
+
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+# build a synonym map based on similarity: tags are grouped transitively (union-find) over all
+# pairs whose vector cosine similarity is above threshold
+def build_synonym_map(tags, threshold=0.8, cache_path=SYNONYM_VECTOR_CACHE):
+    tags = list(dict.fromkeys(tags))
+    wanted = set(tags)
+    cache = _load_vector_cache(cache_path, threshold)
+    if cache:
+        cached_tags, cached_vectors, cached_edges, cached_no_vector = cache
+    else:
+        cached_tags, cached_vectors, cached_edges, cached_no_vector = [], None, set(), set()
+
+    keep = [i for i, tag in enumerate(cached_tags) if tag in wanted]
+    old_tags = [cached_tags[i] for i in keep]
+    known = set(old_tags) | cached_no_vector
+    new_tags, new_vectors, no_vector = _tag_vectors([tag for tag in tags if tag not in known])
+    no_vector |= cached_no_vector & wanted
+
+    if old_tags:
+        all_vectors = np.concatenate([cached_vectors[keep], new_vectors]) if len(new_tags) else cached_vectors[keep]
+    else:
+        all_vectors = new_vectors
+    all_tags = old_tags + new_tags
+    old_set = set(old_tags)
+    edges = {(a, b) for a, b in cached_edges if a in old_set and b in old_set}
+    if new_tags:
+        print(f"🧮 Vergleiche {len(new_tags)} neue Tags mit {len(all_tags)} Tag-Vektoren ...")
+        for i, j in _similar_pairs(new_vectors, all_vectors, len(old_tags), threshold):
+            edges.add((all_tags[i], all_tags[j]))
+    if cache_path:
+        _save_vector_cache(cache_path, threshold, all_tags, all_vectors, edges, no_vector)
+
+    positions = {tag: i for i, tag in enumerate(all_tags)}
+    parent = list(range(len(all_tags)))
+    for a, b in edges:
+        root_a, root_b = _find(parent, positions[a]), _find(parent, positions[b])
+        if root_a != root_b:
+            parent[root_b] = root_a
+    groups = {}
+    for i, tag in enumerate(all_tags):
+        groups.setdefault(_find(parent, i), []).append(tag)
+    synonym_groups = sorted(sorted(group) for group in groups.values() if len(group) > 1)
     # Umwandlung in Mapping: jeweils erstes Wort als Key
-    return {group[0]: group[1:] for group in synonym_groups if len(group) > 1}
+    return {group[0]: group[1:] for group in synonym_groups}
@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+
+
+# resources/card_tags_merged.json -> resources/card_tags_merged.sqlite
+def store_path_for(json_path):
+    return os.path.splitext(json_path)[0] + ".sqlite"
+
+
+# all files belonging to a store (SQLite keeps WAL and shared-memory files next to the database)
+def store_files(json_path):
+    path = store_path_for(json_path)
+    return [path, path + "-wal", path + "-shm"]
+
+
+# Append-only result store (SQLite in WAL mode). Every put is committed on its own,
+# so a crashed run resumes exactly where it stopped. compact() materializes the
+# JSON file for the frontend by streaming rows, without loading them into memory.
+class ResultStore:
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self.path = store_path_for(json_path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.commit()
+        self._import_legacy_json()
+
+    # one-time migration of results written by earlier versions
+    def _import_legacy_json(self):
+        if len(self) or not os.path.exists(self.json_path):
+            return
+        with open(self.json_path, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+        self.put_many(existing.items())
+        print(f"ℹ️  {len(existing)} vorhandene Einträge aus {self.json_path} übernommen.")
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __contains__(self, key):
+        return self.conn.execute("SELECT 1 FROM results WHERE id = ?", (key,)).fetchone() is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ids(self):
+        return {row[0] for row in self.conn.execute("SELECT id FROM results")}
+
+    def get(self, key, default=None):
+        row = self.conn.execute("SELECT data FROM results WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (id, data) VALUES (?, ?)",
+                ((key, json.dumps(value, ensure_ascii=False)) for key, value in items)
+            )
+
+    def items(self):
+        for key, data in self.conn.execute("SELECT id, data FROM results ORDER BY id"):
+            yield key, json.loads(data)
+
+    # items in id order, fetched page by page so the store can be written while iterating
+    def batches(self, size=1000):
+        last = ""
+        while True:
+            rows = self.conn.execute(
+                "SELECT id, data FROM results WHERE id > ? ORDER BY id LIMIT ?", (last, size)
+            ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [(key, json.loads(data)) for key, data in rows]
+
+    # write all results as one JSON object; rows are copied as stored, one card per line
+    def compact(self, output_path=None):
+        output_path = output_path or self.json_path
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("{")
+            separator = "\n"
+            for key, data in self.conn.execute("SELECT id, data FROM results ORDER BY id"):
+                f.write(f"{separator}{json.dumps(key)}: {data}")
+                separator = ",\n"
+            f.write("\n}\n")
+        os.replace(tmp_path, output_path)
+        return output_path
+
+    def close(self):
+        self.conn.close()
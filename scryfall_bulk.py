@@ -0,0 +1,171 @@
+import json
+import os
+import sqlite3
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# the only card fields the pipeline reads from the bulk file
+BULK_FIELDS = ("id", "name", "colors", "type_line", "oracle_text", "flavor_text", "legalities", "image_uris")
+
+_WHITESPACE = " \t\n\r"
+
+
+def _project(card, fields):
+    if fields is None:
+        return card
+    return {field: card[field] for field in fields if field in card}
+
+
+# incremental decoder for a top-level JSON array: decodes one element at a time from a sliding buffer
+def _iter_array(f, chunk_size):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError("Unerwartetes Dateiende in der Bulk-JSON")
+            fill()
+            continue
+
+        char = buffer[pos]
+        if not started:
+            if char != "[":
+                raise ValueError("Bulk-JSON muss ein Array sein")
+            started = True
+            pos += 1
+            continue
+        if char == "]":
+            return
+        if char == ",":
+            pos += 1
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        # the element is complete only once its separator is in the buffer
+        # (a number cut at the buffer end would otherwise decode as a shorter one)
+        after = end
+        while after < len(buffer) and buffer[after] in _WHITESPACE:
+            after += 1
+        if after >= len(buffer) or buffer[after] not in ",]":
+            if eof:
+                raise ValueError(f"Ungültige Bulk-JSON an Position {after}")
+            fill()
+            continue
+        pos = end
+        yield item
+
+
+# streams the cards of a Scryfall bulk file, keeping only the given fields (None = all)
+def iter_bulk_cards(bulk_json_path, fields=BULK_FIELDS, chunk_size=1 << 20):
+    if ijson is not None:
+        # ijson parses bytes; a text file would be re-encoded to UTF-8 first
+        with open(bulk_json_path, 'rb') as f:
+            for card in ijson.items(f, "item", use_float=True):
+                yield _project(card, fields)
+    else:
+        with open(bulk_json_path, 'r', encoding='utf-8') as f:
+            for card in _iter_array(f, chunk_size):
+                yield _project(card, fields)
+
+
+def sidecar_path_for(bulk_json_path):
+    return os.path.splitext(bulk_json_path)[0] + ".slim.sqlite"
+
+
+# Id-indexed sidecar of the projected bulk fields for random lookup. It is rebuilt by one
+# streaming pass whenever the bulk file changes, so lookups never need the bulk file in memory.
+# The rebuild writes a temporary file that replaces the sidecar once complete, so readers
+# (e.g. other nodes of a sharded run) never wait on a half-written index.
+class BulkCardLookup:
+    def __init__(self, bulk_json_path, sidecar_path=None):
+        self.bulk_json_path = bulk_json_path
+        self.path = sidecar_path or sidecar_path_for(bulk_json_path)
+        self.conn = None
+        if not os.path.exists(self.path) or self._stored_signature(self.path) != self._source_signature():
+            self.rebuild()
+        else:
+            self.conn = sqlite3.connect(self.path, timeout=60)
+
+    def _source_signature(self):
+        st = os.stat(self.bulk_json_path)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    @staticmethod
+    def _stored_signature(path):
+        conn = sqlite3.connect(path, timeout=60)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        except sqlite3.OperationalError:
+            # sidecar of an interrupted older build without tables
+            row = None
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def rebuild(self, batch_size=1000):
+        print(f"🗂️  Erstelle Index für {self.bulk_json_path} ...")
+        source = self._source_signature()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            with conn:
+                conn.execute("CREATE TABLE cards (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                batch = []
+                for card in iter_bulk_cards(self.bulk_json_path):
+                    batch.append((card["id"], json.dumps(card, ensure_ascii=False)))
+                    if len(batch) >= batch_size:
+                        conn.executemany("INSERT OR REPLACE INTO cards (id, data) VALUES (?, ?)", batch)
+                        batch = []
+                conn.executemany("INSERT OR REPLACE INTO cards (id, data) VALUES (?, ?)", batch)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('source', ?)", (source,))
+        finally:
+            conn.close()
+        if self.conn is not None:
+            self.conn.close()
+        os.replace(tmp_path, self.path)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    def __contains__(self, card_id):
+        return self.conn.execute("SELECT 1 FROM cards WHERE id = ?", (card_id,)).fetchone() is not None
+
+    def get(self, card_id, default=None):
+        row = self.conn.execute("SELECT data FROM cards WHERE id = ?", (card_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,173 @@
+import re
+from itertools import islice
+
+_NONZERO_BYTE = re.compile(rb"[^\x00]")
+_TOKEN = re.compile(r"\w+")
+# bit positions set in each byte value
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def popcount(bits):
+    if hasattr(bits, "bit_count"):
+        return bits.bit_count()
+    return bin(bits).count("1")
+
+
+def type_tokens(type_line):
+    return _TOKEN.findall((type_line or "").lower())
+
+
+# positions of all set bits in ascending order; zero bytes are skipped by the regex engine
+def iter_bits(bits):
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for match in _NONZERO_BYTE.finditer(data):
+        base = match.start() * 8
+        for bit in _BYTE_BITS[data[match.start()]]:
+            yield base + bit
+
+
+def bits_from_positions(positions):
+    data = bytearray()
+    for i in positions:
+        byte = i >> 3
+        if byte >= len(data):
+            data.extend(bytes(byte - len(data) + 1))
+        data[byte] |= 1 << (i & 7)
+    return int.from_bytes(data, "little")
+
+
+# In-memory inverted index over the card DB. Every posting list is a Python int used as a
+# bitmap (bit i = i-th card), so AND/OR of posting lists run in C over machine words.
+class CardIndex:
+    def __init__(self, card_ids, cards, type_lines, tag_postings, color_postings, legal_postings, type_postings):
+        self.card_ids = card_ids
+        self.cards = cards
+        self.type_lines = type_lines
+        self.tag_postings = tag_postings
+        self.color_postings = color_postings
+        self.legal_postings = legal_postings
+        self.type_postings = type_postings
+        self.all_bits = (1 << len(card_ids)) - 1
+        self._sizes = {}
+        self._type_substring_cache = {}
+        self._positions = None
+
+    @classmethod
+    def from_cards(cls, card_data):
+        card_ids = list(card_data)
+        cards = [card_data[card_id] for card_id in card_ids]
+        type_lines = [(card.get("type_line") or "").lower() for card in cards]
+        tag_positions, color_positions, legal_positions, type_positions = {}, {}, {}, {}
+        for i, card in enumerate(cards):
+            for tag in set(card.get("tags") or []):
+                tag_positions.setdefault(tag, []).append(i)
+            for color in set(card.get("colors") or []):
+                color_positions.setdefault(color, []).append(i)
+            for fmt, status in (card.get("legalities") or {}).items():
+                if status == "legal":
+                    legal_positions.setdefault(fmt, []).append(i)
+            for token in set(type_tokens(type_lines[i])):
+                type_positions.setdefault(token, []).append(i)
+        return cls(
+            card_ids, cards, type_lines,
+            *({key: bits_from_positions(positions) for key, positions in postings.items()}
+              for postings in (tag_positions, color_positions, legal_positions, type_positions))
+        )
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    # popcount of a posting list, cached per (kind, key)
+    def _posting_size(self, kind, key, bits):
+        size = self._sizes.get((kind, key))
+        if size is None:
+            size = popcount(bits)
+            if bits:
+                self._sizes[(kind, key)] = size
+        return size
+
+    def _cache_type_bits(self, key, bits):
+        if len(self._type_substring_cache) >= 4096:
+            self._type_substring_cache.clear()
+        self._type_substring_cache[key] = bits
+
+    # cards whose type line contains token as a substring of one of its words
+    def _type_substring_bits(self, token):
+        bits = self.type_postings.get(token)
+        if bits is not None:
+            return bits
+        bits = self._type_substring_cache.get(token)
+        if bits is None:
+            bits = 0
+            for word, word_bits in self.type_postings.items():
+                if token in word:
+                    bits |= word_bits
+            self._cache_type_bits(token, bits)
+        return bits
+
+    # cards whose lower-cased type line contains needle
+    def _type_bits(self, needle):
+        tokens = type_tokens(needle)
+        if tokens == [needle]:
+            return self._type_substring_bits(needle)
+        bits = self._type_substring_cache.get(needle)
+        if bits is None:
+            bits = self.all_bits
+            for token in tokens:
+                bits &= self._type_substring_bits(token)
+            # needles spanning separators (or without word characters) are verified on the candidates
+            bits = bits_from_positions(i for i in iter_bits(bits) if needle in self.type_lines[i])
+            self._cache_type_bits(needle, bits)
+        return bits
+
+    # evaluates the filters as bitmap intersections, smallest posting list first;
+    # tag_alternatives maps a query tag to tags that also satisfy it (e.g. its synonyms)
+    def query(self, tags=(), colors=(), type_contains=None, legal_in=None, tag_alternatives=None):
+        terms = []
+        for tag in set(tags or []):
+            alternatives = tag_alternatives.get(tag) if tag_alternatives else None
+            if alternatives:
+                tag_bits = 0
+                for alternative in alternatives:
+                    tag_bits |= self.tag_postings.get(alternative, 0)
+                terms.append((popcount(tag_bits), tag_bits))
+                continue
+            tag_bits = self.tag_postings.get(tag, 0)
+            terms.append((self._posting_size("tag", tag, tag_bits), tag_bits))
+        if colors:
+            color_bits = 0
+            for color in set(colors):
+                color_bits |= self.color_postings.get(color, 0)
+            terms.append((popcount(color_bits), color_bits))
+        if legal_in:
+            fmt = legal_in.lower()
+            legal_bits = self.legal_postings.get(fmt, 0)
+            terms.append((self._posting_size("legal", fmt, legal_bits), legal_bits))
+
+        if type_contains:
+            type_bits = self._type_bits(type_contains.lower())
+            terms.append((self._posting_size("type", type_contains.lower(), type_bits), type_bits))
+
+        bits = self.all_bits
+        for _, term in sorted(terms, key=lambda t: t[0]):
+            bits &= term
+            if not bits:
+                return 0
+        return bits
+
+    # position of a card id or None; a CardStore finds it by binary search, in-memory
+    # cards get an id -> position dict on first use
+    def position(self, card_id):
+        find = getattr(self.cards, "find", None)
+        if find is not None:
+            return find(card_id)
+        if self._positions is None:
+            self._positions = {cid: i for i, cid in enumerate(self.card_ids)}
+        return self._positions.get(card_id)
+
+    def count(self, bits):
+        return popcount(bits)
+
+    def page(self, bits, offset=0, limit=None):
+        positions = islice(iter_bits(bits), offset, None if limit is None else offset + limit)
+        return [(self.card_ids[i], self.cards[i]) for i in positions]
@@ -0,0 +1,196 @@
+import glob
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+
+from result_store import ResultStore, store_files, store_path_for
+
+QUEUE_PATH = "resources/work_queue.sqlite"
+# claims not completed within the lease go back to the queue (node crashed or hangs)
+LEASE_SECONDS = 600
+# a card that failed this often is marked failed instead of being handed out again
+MAX_ATTEMPTS = 3
+# a failed card is handed out again after RETRY_SECONDS, doubled with every further attempt
+RETRY_SECONDS = 30
+
+
+# deterministic shard of a card: the same on every node, independent of directory order
+def shard_of(card_id, shards):
+    return int.from_bytes(hashlib.blake2b(card_id.encode("utf-8"), digest_size=8).digest(), "big") % shards
+
+
+def default_node_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# resources/card_tags_merged.json -> resources/card_tags_merged.shard-3-of-8.json / .node-<name>.json
+def partial_output_path(output_path, shard=None, shards=None, node=None):
+    base, ext = os.path.splitext(output_path)
+    if node is not None:
+        return f"{base}.node-{node}{ext}"
+    return f"{base}.shard-{shard}-of-{shards}{ext}"
+
+
+def partial_output_paths(output_path):
+    base, ext = os.path.splitext(output_path)
+    paths = []
+    for pattern in (f"{base}.shard-*", f"{base}.node-*"):
+        for path in glob.glob(store_path_for(pattern + ext)):
+            paths.append(os.path.splitext(path)[0] + ext)
+    return sorted(paths)
+
+
+# merge step: copies the results of all partial stores into the store at output_path and
+# writes its JSON file; partial stores are kept so a node can resume, remove=True deletes them
+def merge_partial_results(output_path="resources/card_tags_merged.json", remove=False):
+    paths = partial_output_paths(output_path)
+    if not paths:
+        print(f"ℹ️  Keine Teilergebnisse für {output_path} gefunden.")
+        return 0
+    merged = 0
+    with ResultStore(output_path) as store:
+        for path in paths:
+            count = 0
+            with ResultStore(path) as partial:
+                for batch in partial.batches(1000):
+                    store.put_many(batch)
+                    count += len(batch)
+            print(f"🧩 {count} Karten aus {path} übernommen.")
+            merged += count
+        store.compact()
+    if remove:
+        for path in paths:
+            for file in [path] + store_files(path):
+                if os.path.exists(file):
+                    os.remove(file)
+    print(f"✅ {merged} Karten aus {len(paths)} Teilergebnissen in {output_path} zusammengeführt.")
+    return merged
+
+
+# Work queue shared by all nodes (SQLite, one row per card). A node claims a chunk of cards
+# with a lease, writes their results to its own partial store and marks them done. Claims
+# whose lease expired are handed out again, failed cards are retried up to MAX_ATTEMPTS times.
+class WorkQueue:
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # claims of concurrent nodes wait for each other instead of failing
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS work (card_id TEXT PRIMARY KEY, state TEXT NOT NULL DEFAULT 'pending', "
+            "owner TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, not_before REAL)"
+        )
+        # queues created before retries were delayed
+        if "not_before" not in {row[1] for row in self.conn.execute("PRAGMA table_info(work)")}:
+            self.conn.execute("ALTER TABLE work ADD COLUMN not_before REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS work_state ON work (state, lease_until)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # adds cards not queued yet; every node may call this with its todo list. Cards of the list
+    # that failed earlier (no result stored) are queued again with fresh attempts.
+    def add(self, card_ids):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "INSERT INTO work (card_id) VALUES (?) ON CONFLICT (card_id) DO UPDATE SET state = 'pending', owner = NULL, "
+            "lease_until = NULL, attempts = 0, not_before = NULL WHERE state = 'failed'",
+            ((card_id,) for card_id in card_ids)
+        )
+        self.conn.execute("COMMIT")
+
+    # up to n card ids for owner: pending cards whose retry delay is over first, then expired claims
+    def claim(self, owner, n, lease_seconds=LEASE_SECONDS):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "UPDATE work SET state = 'failed', owner = NULL WHERE state = 'claimed' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS)
+            )
+            card_ids = [row[0] for row in self.conn.execute(
+                "SELECT card_id FROM work WHERE (state = 'pending' AND (not_before IS NULL OR not_before <= ?)) "
+                "OR (state = 'claimed' AND lease_until < ?) ORDER BY state = 'claimed', card_id LIMIT ?",
+                (now, now, n)
+            )]
+            self.conn.executemany(
+                "UPDATE work SET state = 'claimed', owner = ?, lease_until = ?, attempts = attempts + 1, not_before = NULL "
+                "WHERE card_id = ?",
+                ((owner, now + lease_seconds, card_id) for card_id in card_ids)
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return card_ids
+
+    # extends the leases of all cards owner is still working on
+    def renew(self, owner, lease_seconds=LEASE_SECONDS):
+        self.conn.execute(
+            "UPDATE work SET lease_until = ? WHERE state = 'claimed' AND owner = ?",
+            (time.time() + lease_seconds, owner)
+        )
+
+    # a claim that expired and was taken over by another node is not touched
+    def complete(self, owner, card_ids):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "UPDATE work SET state = 'done', lease_until = NULL WHERE card_id = ? AND owner = ? AND state = 'claimed'",
+            ((card_id, owner) for card_id in card_ids)
+        )
+        self.conn.execute("COMMIT")
+
+    # back to the queue after a delay, so the node does not burn all attempts right away;
+    # permanent=True marks the card failed at once
+    def fail(self, owner, card_id, permanent=False):
+        self.conn.execute(
+            "UPDATE work SET state = CASE WHEN ? OR attempts >= ? THEN 'failed' ELSE 'pending' END, owner = NULL, "
+            "lease_until = NULL, not_before = ? * (1 << (attempts - 1)) + ? WHERE card_id = ? AND owner = ? AND state = 'claimed'",
+            (permanent, MAX_ATTEMPTS, RETRY_SECONDS, time.time(), card_id, owner)
+        )
+
+    # None when no card is left for owner; otherwise seconds until one may become claimable
+    # (a pending card's retry delay or the first lease of another node that expires)
+    def wait_seconds(self, owner):
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT MIN(CASE WHEN state = 'pending' THEN COALESCE(not_before, 0) ELSE lease_until END) FROM work "
+            "WHERE state = 'pending' OR (state = 'claimed' AND owner != ? AND attempts < ?)",
+            (owner, MAX_ATTEMPTS)
+        ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - now)
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM work GROUP BY state"))
+
+    def close(self):
+        self.conn.close()
+
+
+# items for run_batched: claims chunk_size cards at a time and stops once nothing is claimable;
+# on_claim gets the card ids of each chunk before its items are yielded.
+# Runs in the pipeline's producer thread, so it opens its own connection.
+def iter_claimed(queue_path, owner, img_dir, chunk_size, lease_seconds=LEASE_SECONDS, on_claim=None):
+    with WorkQueue(queue_path) as work:
+        while True:
+            card_ids = work.claim(owner, chunk_size, lease_seconds)
+            if not card_ids:
+                return
+            items = []
+            for card_id in card_ids:
+                path = os.path.join(img_dir, f"{card_id}.jpg")
+                if os.path.exists(path):
+                    items.append((card_id, path))
+                else:
+                    # the image is missing on this node; another node may have it, after the retry delay
+                    work.fail(owner, card_id)
+            if on_claim is not None and items:
+                on_claim([card_id for card_id, _ in items])
+            yield from items
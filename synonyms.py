@@ -0,0 +1,66 @@
+import json
+import os
+
+from result_store import ResultStore
+
+SYNONYM_FILE = "resources/tag_synonyms.json"
+CARD_TAG_FIELDS = ("tags", "auto_tags", "text_tags")
+
+
+def load_synonym_map(path=SYNONYM_FILE):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+# reverse index alias -> canonical tag (canonical tags map to themselves);
+# a tag listed in several groups belongs to the first one, like the old linear scan
+def build_alias_index(synonym_map):
+    index = {}
+    for main_tag, synonyms in synonym_map.items():
+        index.setdefault(main_tag, main_tag)
+        for synonym in synonyms:
+            index.setdefault(synonym, main_tag)
+    return index
+
+
+# canonical tag -> all tags that normalize to it, canonical first
+def build_expansion_index(alias_index):
+    expansions = {}
+    for alias, canonical in alias_index.items():
+        expansions.setdefault(canonical, [canonical])
+        if alias != canonical:
+            expansions[canonical].append(alias)
+    return expansions
+
+
+def load_alias_index(path=SYNONYM_FILE):
+    return build_alias_index(load_synonym_map(path))
+
+
+# canonical tags in first-seen order, duplicates dropped
+def canonical_tags(tags, alias_index):
+    return list(dict.fromkeys(alias_index.get(tag, tag) for tag in tags))
+
+
+# rewrites the tag lists of every card to canonical tags in one sweep over the result store;
+# only changed cards are written back, then the JSON is compacted again
+def normalize_card_tags(merged_path="resources/card_tags_merged.json", synonym_path=SYNONYM_FILE, batch_size=1000):
+    alias_index = load_alias_index(synonym_path)
+    changed = 0
+    with ResultStore(merged_path) as store:
+        if alias_index:
+            for batch in store.batches(batch_size):
+                updates = []
+                for card_id, card in batch:
+                    normalized = {field: canonical_tags(card[field], alias_index)
+                                  for field in CARD_TAG_FIELDS if card.get(field)}
+                    if any(normalized[field] != card[field] for field in normalized):
+                        card.update(normalized)
+                        updates.append((card_id, card))
+                store.put_many(updates)
+                changed += len(updates)
+        store.compact()
+    print(f"🔁 Tags von {changed} Karten auf Synonym-Hauptbegriffe normalisiert.")
+    return changed
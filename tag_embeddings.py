@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import torch
+
+
+CACHE_DIR = "resources/cache"
+
+# in-memory cache: (model name, tags hash) -> normalized embedding matrix
+_MEMORY_CACHE = {}
+
+
+# stable hash over the tag vocabulary (order matters, rows follow the tag order)
+def tags_hash(tags):
+    return hashlib.sha256(json.dumps(list(tags), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _cache_path(model_name, cache_dir=CACHE_DIR):
+    safe_name = model_name.replace("/", "_").replace("\\", "_")
+    return os.path.join(cache_dir, f"tag_embeddings_{safe_name}.pt")
+
+
+# CLIP returns a tensor (transformers 4.x) or an output object with the projected pooler_output (5.x)
+def as_features(output):
+    if isinstance(output, torch.Tensor):
+        return output
+    return output.pooler_output
+
+
+# encode tags with the CLIP text tower and L2-normalize them
+def encode_tags(tags, model, processor, device, batch_size=256):
+    chunks = []
+    with torch.inference_mode():
+        for start in range(0, len(tags), batch_size):
+            # longer texts are cut to CLIP's context length instead of failing in the position embeddings
+            inputs = processor(text=tags[start:start + batch_size], return_tensors="pt", padding=True,
+                               truncation=True, max_length=model.config.text_config.max_position_embeddings)
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+            features = as_features(model.get_text_features(**inputs)).float()
+            chunks.append(torch.nn.functional.normalize(features, dim=-1).cpu())
+    if not chunks:
+        return torch.empty((0, model.config.projection_dim))
+    return torch.cat(chunks)
+
+
+def _load_disk_cache(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return torch.load(path, map_location="cpu")
+    except Exception as e:
+        print(f"⚠️  Tag-Embedding-Cache unlesbar, wird neu erstellt: {e}")
+        return None
+
+
+# returns the normalized text embeddings for tags as a (len(tags), dim) matrix on device.
+# Only tags missing from the on-disk cache are encoded, removed tags are dropped.
+def get_tag_embeddings(tags, model, processor, model_name, device, cache_dir=CACHE_DIR):
+    tags = list(tags)
+    key = (model_name, tags_hash(tags))
+    if key in _MEMORY_CACHE:
+        return _MEMORY_CACHE[key]
+
+    path = _cache_path(model_name, cache_dir)
+    cached = _load_disk_cache(path)
+    if cached and cached.get("model") == model_name and cached.get("tags_hash") == key[1]:
+        matrix = cached["embeddings"]
+    else:
+        known = {}
+        if cached and cached.get("model") == model_name:
+            known = {tag: row for tag, row in zip(cached["tags"], cached["embeddings"])}
+        missing = [tag for tag in dict.fromkeys(tags) if tag not in known]
+        if missing:
+            print(f"🧮 Kodiere {len(missing)} neue Tags mit CLIP ...")
+            known.update(zip(missing, encode_tags(missing, model, processor, device)))
+        if tags:
+            matrix = torch.stack([known[tag] for tag in tags])
+        else:
+            matrix = torch.empty((0, model.config.projection_dim))
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # per process, so nodes sharing the cache directory don't write into the same temp file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save({"model": model_name, "tags_hash": key[1], "tags": tags, "embeddings": matrix}, tmp_path)
+        os.replace(tmp_path, path)
+
+    matrix = matrix.to(device)
+    _MEMORY_CACHE.clear()
+    _MEMORY_CACHE[key] = matrix
+    return matrix
+
+
+# softmax over the tag vocabulary, equivalent to CLIPModel.logits_per_image
+def score_tags(image_features, tag_matrix, logit_scale, tags, threshold=0.15):
+    image_features = torch.nn.functional.normalize(image_features.float(), dim=-1)
+    probs = (logit_scale * image_features @ tag_matrix.T).softmax(dim=-1)
+    return [[tag for tag, score in zip(tags, row.tolist()) if score > threshold] for row in probs]
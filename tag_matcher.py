@@ -0,0 +1,100 @@
+import unicodedata
+from collections import OrderedDict, deque
+
+# matchers for the most recently used tag lists; tags.json changes rarely, so this is a handful
+_MATCHER_CACHE_SIZE = 4
+_matchers = OrderedDict()
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_" or unicodedata.category(char) == "Mn"
+
+
+# Aho-Corasick automaton over the lower-cased tag vocabulary: one pass over the text finds
+# every tag occurrence, independent of the number of tags
+class TagMatcher:
+    def __init__(self, tags):
+        self.tags = list(tags)
+        # lower-cased pattern -> positions of the tags spelled that way
+        self.patterns = OrderedDict()
+        for i, tag in enumerate(self.tags):
+            pattern = tag.lower()
+            if pattern:
+                self.patterns.setdefault(pattern, []).append(i)
+        self._build()
+
+    def _build(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        pattern_list = list(self.patterns)
+        self.pattern_list = pattern_list
+        for n, pattern in enumerate(pattern_list):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(n)
+
+        # breadth-first: failure links point to the longest proper suffix that is also a prefix
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] += self.outputs[self.fail[next_state]]
+
+    # a match counts only if it does not continue a word on either side ("ant" is not in "giant");
+    # edges of the tag that are not word characters themselves need no boundary
+    def _on_boundaries(self, text, start, end, pattern):
+        if start > 0 and _is_word_char(pattern[0]) and _is_word_char(text[start - 1]):
+            return False
+        if end < len(text) and _is_word_char(pattern[-1]) and _is_word_char(text[end]):
+            return False
+        return True
+
+    # tags occurring in text, in vocabulary order
+    def find(self, text):
+        text = text.lower()
+        found = set()
+        state = 0
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        for end, char in enumerate(text, start=1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for n in outputs[state]:
+                if n in found:
+                    continue
+                pattern = self.pattern_list[n]
+                if self._on_boundaries(text, end - len(pattern), end, pattern):
+                    found.add(n)
+        positions = sorted(i for n in found for i in self.patterns[self.pattern_list[n]])
+        return [self.tags[i] for i in positions]
+
+
+# matcher for a tag list, built once per distinct list
+def get_tag_matcher(tags):
+    key = tuple(tags)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = TagMatcher(key)
+        if len(_matchers) > _MATCHER_CACHE_SIZE:
+            _matchers.popitem(last=False)
+    else:
+        _matchers.move_to_end(key)
+    return matcher
+
+
+def match_tags(text, tags):
+    return get_tag_matcher(tags).find(text)
@@ -1,14 +1,34 @@
 import json
+import os
+
+TAG_FILE = "resources/tags.json"
+
+# (path, mtime) -> tags of the last get_tags() call
+_cached = None
 
 
 # Load tags from external file
-def load_tags(tag_file_path="resources/tags.json"):
+def load_tags(tag_file_path=TAG_FILE):
     with open(tag_file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 ## Save tags to external file
-def save_tags(tags, tag_file_path="resources/tags.json"):
+def save_tags(tags, tag_file_path=TAG_FILE):
     with open(tag_file_path, 'w', encoding='utf-8') as f:
         json.dump(tags, f, indent=2)
 
-TAGS = load_tags()
+
+# tags.json, read on first use and again only after the file changed
+def get_tags(tag_file_path=TAG_FILE):
+    global _cached
+    key = (tag_file_path, os.stat(tag_file_path).st_mtime_ns)
+    if _cached is None or _cached[0] != key:
+        _cached = (key, load_tags(tag_file_path))
+    return _cached[1]
+
+
+# TAGS is kept for existing imports, but resolved lazily instead of at import time
+def __getattr__(name):
+    if name == "TAGS":
+        return get_tags()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,136 @@
+import gzip
+import hashlib
+import json
 import os
-import shutil
 
+from result_store import ResultStore, store_files
 
-def export_json_for_frontend():
-    target_path = os.path.join("magic-card-ui", "public", "resources")
-    os.makedirs(target_path, exist_ok=True)
-    for file in os.listdir("resources"):
-        if file.endswith(".json"):
-            shutil.copyfile(os.path.join("resources", file), os.path.join(target_path, file))
-    print("📦 JSON-Dateien ins Frontend exportiert.")
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PUBLIC_DIR = os.path.join("magic-card-ui", "public", "resources")
+TARGET_DIR = os.path.join(PUBLIC_DIR, "cards")
+# cards per index shard; the UI shows the first shard while the others are still loading
+SHARD_SIZE = 2000
+# the only fields CardViewer reads
+UI_FIELDS = ("name", "image_url", "caption", "colors", "tags", "auto_tags", "text_tags")
+TAG_FIELDS = ("tags", "auto_tags", "text_tags")
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _source_signature(merged_path):
+    signature = []
+    for path in store_files(merged_path):
+        if os.path.exists(path):
+            st = os.stat(path)
+            signature.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return signature
+
+
+# writes body as <prefix>.<hash>.json plus .gz/.br variants; a file with that name already
+# has this content, so unchanged shards are not written again
+def _write_hashed(target_dir, prefix, body):
+    name = f"{prefix}.{hashlib.blake2b(body, digest_size=8).hexdigest()}.json"
+    path = os.path.join(target_dir, name)
+    variants = [(path, lambda: body), (path + ".gz", lambda: gzip.compress(body, 9, mtime=0))]
+    if brotli is not None:
+        variants.append((path + ".br", lambda: brotli.compress(body)))
+    written = False
+    for variant_path, encode in variants:
+        if not os.path.exists(variant_path):
+            with open(variant_path + ".tmp", 'wb') as f:
+                f.write(encode())
+            os.replace(variant_path + ".tmp", variant_path)
+            written = True
+    return name, written
+
+
+def _slim(card_id, card):
+    slim = {"id": card_id}
+    for field in UI_FIELDS:
+        value = card.get(field)
+        if value:
+            slim[field] = value
+    return slim
+
+
+# earlier versions copied every JSON file of resources/ (including the Scryfall bulk file) into the UI
+def _remove_legacy_copies(public_dir=PUBLIC_DIR, source_dir="resources"):
+    if not os.path.isdir(public_dir):
+        return
+    for file in os.listdir(public_dir):
+        path = os.path.join(public_dir, file)
+        if file.endswith(".json") and os.path.isfile(path) and os.path.exists(os.path.join(source_dir, file)):
+            os.remove(path)
+            print(f"🗑️  Alte Frontend-Kopie gelöscht: {path}")
+
+
+def _count_facets(facets, card):
+    for tag in {tag for field in TAG_FIELDS for tag in card.get(field) or []}:
+        facets["tags"][tag] = facets["tags"].get(tag, 0) + 1
+    for color in card.get("colors") or ["C"]:
+        facets["colors"][color] = facets["colors"].get(color, 0) + 1
+
+
+# Frontend export: the slim card index in fixed-size shards with content-hashed names, tag and
+# color facet counts and manifest.json (the only file without a hash) pointing to both.
+# Skipped entirely if the result store did not change since the last export.
+def export_json_for_frontend(merged_path="resources/card_tags_merged.json", target_dir=TARGET_DIR, shard_size=SHARD_SIZE):
+    os.makedirs(target_dir, exist_ok=True)
+    _remove_legacy_copies()
+    manifest_path = os.path.join(target_dir, "manifest.json")
+    source = _source_signature(merged_path)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        files = [shard["file"] for shard in previous.get("shards", [])] + [previous.get("facets")]
+        if previous.get("source") == source and all(name and os.path.exists(os.path.join(target_dir, name)) for name in files):
+            print("📦 Frontend-Export unverändert, übersprungen.")
+            return manifest_path
+
+    shards, shard = [], []
+    facets = {"total": 0, "tags": {}, "colors": {}}
+    written = 0
+
+    def flush():
+        nonlocal written
+        name, changed = _write_hashed(target_dir, f"cards-{len(shards):04d}", _dumps(shard))
+        shards.append({"file": name, "count": len(shard)})
+        written += changed
+
+    with ResultStore(merged_path) as store:
+        for batch in store.batches(shard_size):
+            for card_id, card in batch:
+                shard.append(_slim(card_id, card))
+                _count_facets(facets, card)
+                facets["total"] += 1
+                if len(shard) == shard_size:
+                    flush()
+                    shard = []
+    if shard:
+        flush()
+
+    facets["tags"] = dict(sorted(facets["tags"].items(), key=lambda item: (-item[1], item[0])))
+    facets["colors"] = dict(sorted(facets["colors"].items(), key=lambda item: (-item[1], item[0])))
+    facets_name, changed = _write_hashed(target_dir, "facets", _dumps(facets))
+    written += changed
+
+    manifest = {"total": facets["total"], "shards": shards, "facets": facets_name, "source": source}
+    with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # hashed files of earlier exports are no longer referenced
+    keep = {manifest["facets"], *(shard["file"] for shard in shards)}
+    for file in os.listdir(target_dir):
+        base = file.removesuffix(".gz").removesuffix(".br")
+        if base != "manifest.json" and base not in keep:
+            os.remove(os.path.join(target_dir, file))
+
+    print(f"📦 Frontend-Export: {facets['total']} Karten in {len(shards)} Shards, {written} Dateien neu geschrieben (Rest unverändert).")
+    return manifest_path